@@ -0,0 +1,97 @@
+"""
+Бенчмарк часу старту: скільки займає `import main` (усі модулі бота до початку polling)
+за даними `python -X importtime`, і які модулі найдорожчі.
+
+Заодно перевіряє, що важкі SDK (jira, openai, matplotlib, graphviz) не імпортуються при старті -
+вони мають підвантажуватися ліниво при першому використанні або у фоновому прогріві.
+
+Запуск з кореня репозиторію:
+    python benchmarks/import_time.py [--runs 5] [--budget-ms 1000] [--top 15]
+
+Код виходу 1, якщо важкий SDK потрапив в імпорт при старті або медіана перевищує бюджет.
+"""
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Пакети, що не повинні імпортуватися при старті бота
+LAZY_PACKAGES = ('jira', 'openai', 'matplotlib', 'graphviz')
+
+# "import time: self [us] | cumulative | imported package"
+_LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+def measure_once():
+    """Один запуск `python -X importtime -c 'import main'` у чистому процесі: (мс для main, {модуль: self мкс})"""
+    env = dict(os.environ)
+    # Значення-заглушки, щоб конфігурація імпортувалася без .env; мережевих звернень при імпорті немає
+    env.setdefault('BOT_TOKEN', '0:benchmark')
+    env.setdefault('OPENAI_API_KEY', 'benchmark')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    if result.returncode != 0:
+        sys.exit(f"import main завершився з помилкою:\n{result.stderr[-2000:]}")
+
+    main_us = None
+    self_times = {}
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        self_times[module] = int(self_us)
+        if module == 'main' and not indent:
+            main_us = int(cumulative_us)
+    return main_us / 1000, self_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='кількість запусків (береться медіана)')
+    parser.add_argument('--budget-ms', type=float, default=1000.0, help='допустима медіана import main, мс')
+    parser.add_argument('--top', type=int, default=15, help='скільки найдорожчих пакетів показати')
+    args = parser.parse_args()
+
+    totals = []
+    package_times = defaultdict(list)
+    imported = set()
+    for _ in range(args.runs):
+        total_ms, self_times = measure_once()
+        totals.append(total_ms)
+        imported.update(self_times)
+        per_package = defaultdict(int)
+        for module, self_us in self_times.items():
+            per_package[module.split('.')[0]] += self_us
+        for package, self_us in per_package.items():
+            package_times[package].append(self_us / 1000)
+
+    median = statistics.median(totals)
+    print(f"import main: медіана {median:.0f} мс (мін {min(totals):.0f}, макс {max(totals):.0f}, запусків {args.runs})")
+    print(f"\nНайдорожчі пакети (власний час модулів, медіана):")
+    ranked = sorted(package_times.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for package, times in ranked[:args.top]:
+        print(f"  {package:<24} {statistics.median(times):8.1f} мс")
+
+    failed = False
+    eager = sorted({module.split('.')[0] for module in imported} & set(LAZY_PACKAGES))
+    if eager:
+        print(f"\nПОМИЛКА: при старті імпортуються важкі SDK: {', '.join(eager)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"\nПОМИЛКА: медіана {median:.0f} мс перевищує бюджет {args.budget_ms:.0f} мс")
+        failed = True
+    if not failed:
+        print(f"\nOK: важкі SDK не імпортуються при старті, бюджет {args.budget_ms:.0f} мс дотримано")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Мікро-бенчмарк аналізу настрою: попередній посимвольний аналіз (цикл по ключових словах
+та re.search для кожного шаблону) проти MoodMatcher (автомат Ахо-Корасік).
+
+Запуск з кореня репозиторію:
+    python benchmarks/mood_matcher_bench.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.mood_manager import MOOD_CONFIG  # noqa: E402
+from utils.mood_matcher import MoodMatcher  # noqa: E402
+
+# Типові повідомлення з робочого чату
+MESSAGES = [
+    "@tars_bot глянь діаграму блоків, там порти не з'єднуються 😂",
+    "хахаха ну це топ, лол",
+    "блін, знову не працює білд, все пропало",
+    "хто пам'ятає що ми вирішили про API для бази даних?",
+    "нічого собі, круто вийшло з новим алгоритмом",
+    "це якийсь треш, а не код, хто це писав взагалі 😡",
+    "ну ок, завтра гляну клас і метод, зараз не можу",
+    "оххх, складно. Проблема в тому що система не бачить функція ініціалізації",
+    "Колеги, нагадую: рев'ю SysML моделі о 15:00, не запізнюйтесь",
+    "супер, дякую! 😄",
+]
+
+
+def legacy_scores(text, mood_config):
+    """Попередня реалізація MoodManager._analyze_keywords"""
+    text_lower = text.lower()
+    scores = {mood: 0 for mood in mood_config}
+    for mood, config in mood_config.items():
+        for keyword in config['keywords']:
+            if keyword in text_lower:
+                scores[mood] += 1
+        for pattern in config['patterns']:
+            if re.search(pattern, text, re.IGNORECASE):
+                scores[mood] += 2
+    return scores
+
+
+def expand_config(mood_config, factor):
+    """Конфіг з кількістю ключових слів у factor разів більшою (синтетичні варіації)"""
+    expanded = {}
+    for mood, config in mood_config.items():
+        keywords = list(config['keywords'])
+        for i in range(1, factor):
+            keywords += [f"{keyword}{i}" for keyword in config['keywords']]
+        expanded[mood] = dict(config, keywords=keywords)
+    return expanded
+
+
+def bench(label, mood_config, number=2000):
+    matcher = MoodMatcher(mood_config)
+    mismatches = [m for m in MESSAGES
+                  if legacy_scores(m, {k: dict(v, keywords=[w.lower() for w in v['keywords']])
+                                       for k, v in mood_config.items()}) != matcher.scores(m)]
+
+    legacy = timeit.timeit(lambda: [legacy_scores(m, mood_config) for m in MESSAGES], number=number)
+    compiled = timeit.timeit(lambda: [matcher.scores(m) for m in MESSAGES], number=number)
+    per_message = number * len(MESSAGES)
+    print(
+        f"{label:>12}: legacy {legacy / per_message * 1e6:7.2f} мкс/повід., "
+        f"matcher {compiled / per_message * 1e6:7.2f} мкс/повід., "
+        f"x{legacy / compiled:.1f}, розбіжностей: {len(mismatches)}"
+    )
+
+
+if __name__ == '__main__':
+    bench("поточний", MOOD_CONFIG)
+    bench("x10 слів", expand_config(MOOD_CONFIG, 10))
@@ -15,6 +15,21 @@ JIRA_SERVER = os.getenv('JIRA_SERVER', '')
 JIRA_EMAIL = os.getenv('JIRA_EMAIL', '')
 JIRA_API_TOKEN = os.getenv('JIRA_API_TOKEN', '')
 JIRA_PROJECT_KEY = os.getenv('JIRA_PROJECT_KEY', '')
+# Дедлайн одного звернення до Jira (секунди) та кількість потоків, у яких виконуються синхронні виклики Jira
+JIRA_TIMEOUT = float(os.getenv('JIRA_TIMEOUT', '15'))
+JIRA_MAX_WORKERS = int(os.getenv('JIRA_MAX_WORKERS', '4'))
+# Через скільки секунд повторювати підключення до Jira після невдалої спроби
+JIRA_RECONNECT_INTERVAL = float(os.getenv('JIRA_RECONNECT_INTERVAL', '60'))
+# Кеш списку завдань Jira: скільки секунд список свіжий, скільки ще можна віддавати застарілий
+# (з фоновим оновленням), як часто робити повну синхронізацію замість дельти, ліміт завдань у синхронізації
+# та скільки завдань показувати
+JIRA_CACHE_TTL = float(os.getenv('JIRA_CACHE_TTL', '60'))
+JIRA_CACHE_MAX_STALE = float(os.getenv('JIRA_CACHE_MAX_STALE', '900'))
+JIRA_FULL_SYNC_INTERVAL = float(os.getenv('JIRA_FULL_SYNC_INTERVAL', '3600'))
+JIRA_SYNC_LIMIT = int(os.getenv('JIRA_SYNC_LIMIT', '100'))
+JIRA_ISSUES_SHOWN = int(os.getenv('JIRA_ISSUES_SHOWN', '10'))
+# Розмір сторінки в переглядачі завдань (кнопки попередня/наступна)
+JIRA_PAGE_SIZE = int(os.getenv('JIRA_PAGE_SIZE', '10'))
 
 # Налаштування бази даних
 DATABASE = 'data/chatik.db'
@@ -24,9 +39,55 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 TEMP_DIR = os.path.join(DATA_DIR, 'temp')
 
-# Створюємо необхідні директорії
-os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(TEMP_DIR, exist_ok=True)
+
+def ensure_data_dirs() -> None:
+    """Створює робочі директорії (викликається при старті бота, а не при імпорті конфігурації)"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(TEMP_DIR, exist_ok=True)
+
+
+# Інтервал пакетного запису змінених chat_data/user_data/bot_data у DATABASE, секунди
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv('PERSISTENCE_FLUSH_INTERVAL', '30'))
+
+# Повнотекстовий індекс повідомлень (FTS5 у DATABASE): пакетний запис раз на інтервал (секунди) або при накопиченні пакета,
+# кількість результатів /search та кількість давніших повідомлень, що смарт-агент додає до контексту
+SEARCH_INDEX_FLUSH_INTERVAL = float(os.getenv('SEARCH_INDEX_FLUSH_INTERVAL', '2'))
+SEARCH_INDEX_BATCH_SIZE = int(os.getenv('SEARCH_INDEX_BATCH_SIZE', '50'))
+SEARCH_RESULTS_LIMIT = int(os.getenv('SEARCH_RESULTS_LIMIT', '5'))
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '3'))
+
+# Семантичний векторний індекс історії (матриця float32 на чат у DATA_DIR/vectors):
+# ембедер (hashing - локальний, openai - EMBEDDING_MODEL) та розмірність векторів
+EMBEDDER = os.getenv('EMBEDDER', 'hashing')
+EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', '512'))
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
+VECTOR_INDEX_DIR = os.path.join(DATA_DIR, 'vectors')
+VECTOR_INDEX_MAX_OPEN_CHATS = int(os.getenv('VECTOR_INDEX_MAX_OPEN_CHATS', '32'))
+# Контекст смарт-агента: останні CONTEXT_RECENT_RECORDS записів історії завжди, а давніші повідомлення -
+# лише SEMANTIC_TOP_K найсхожіших на питання (зі схожістю не нижче SEMANTIC_MIN_SCORE)
+CONTEXT_RECENT_RECORDS = int(os.getenv('CONTEXT_RECENT_RECORDS', '10'))
+SEMANTIC_TOP_K = int(os.getenv('SEMANTIC_TOP_K', '5'))
+SEMANTIC_MIN_SCORE = float(os.getenv('SEMANTIC_MIN_SCORE', '0.2'))
+
+# Сховище зображень: ліміт сирих байтів у пам'яті та директорія для вивантаження на диск
+IMAGE_STORE_MAX_MEMORY = int(os.getenv('IMAGE_STORE_MAX_MEMORY', str(64 * 1024 * 1024)))
+IMAGE_SPILL_DIR = os.path.join(DATA_DIR, 'images')
+# Корисна для vision-моделі довжина довшої сторони зображення, пікселі
+VISION_MAX_EDGE = int(os.getenv('VISION_MAX_EDGE', '1024'))
+# Зображення з довшою стороною до цього значення відправляються з detail=low
+VISION_LOW_DETAIL_EDGE = int(os.getenv('VISION_LOW_DETAIL_EDGE', '512'))
+# Якість JPEG при перекодуванні зображень перед vision-запитом
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '80'))
+# Кількість потоків для обробки зображень
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+
+# Реєстр file_id завантажених аватарів настрою (щоб не вивантажувати ті самі PNG з кожною відповіддю)
+AVATAR_CACHE_FILE = os.path.join(DATA_DIR, 'avatar_file_ids.json')
+
+# Агрегація медіа-груп (альбомів): межі адаптивного вікна тиші та жорсткий TTL групи, секунди
+MEDIA_GROUP_MIN_WINDOW = float(os.getenv('MEDIA_GROUP_MIN_WINDOW', '0.6'))
+MEDIA_GROUP_MAX_WINDOW = float(os.getenv('MEDIA_GROUP_MAX_WINDOW', '2.0'))
+MEDIA_GROUP_TTL = float(os.getenv('MEDIA_GROUP_TTL', '30'))
 
 # Налаштування для візуалізації діаграм
 DIAGRAM_SETTINGS = {
@@ -55,6 +116,52 @@ EMOJIS = {
 # OpenAI API Key
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Шлюз до LLM: дедлайн виклику (секунди), максимум запитів у польоті, повтори тимчасових помилок,
+# базова та максимальна затримка між повторами (секунди), розмір пулу HTTP-з'єднань
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_POOL_CONNECTIONS = int(os.getenv("LLM_POOL_CONNECTIONS", "20"))
+
+# Потокова доставка відповідей смарт-агента (плейсхолдер + поступове редагування повідомлення)
+STREAMING_REPLIES = os.getenv("STREAMING_REPLIES", "1") == "1"
+# Мінімальний інтервал між редагуваннями повідомлення, секунди (Telegram обмежує частоту edit)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# Кеш відповідей LLM: час життя (секунди), максимум записів та байтів
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(2 * 1024 * 1024)))
+
+# Бюджет контексту запиту смарт-агента в токенах (оцінка) для кожної моделі
+CONTEXT_TOKEN_BUDGETS = {
+    "gpt-4o-mini": int(os.getenv("CONTEXT_BUDGET_GPT_4O_MINI", "3000")),
+    "gpt-4o": int(os.getenv("CONTEXT_BUDGET_GPT_4O", "5000")),
+}
+# Максимальна оцінка токенів відповіді бота в історії, коли історія не вміщується в бюджет
+BOT_REPLY_MAX_TOKENS = int(os.getenv("BOT_REPLY_MAX_TOKENS", "120"))
+# Частка бюджету, яку можуть займати зображення, та максимальна кількість зображень у запиті
+CONTEXT_IMAGE_SHARE = float(os.getenv("CONTEXT_IMAGE_SHARE", "0.5"))
+MAX_CONTEXT_IMAGES = int(os.getenv("MAX_CONTEXT_IMAGES", "3"))
+
+# Фонове підсумовування історії, що вийшла за межі вікна: вмикач, розмір пакета записів,
+# максимальна довжина підсумку в токенах та модель
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "1") == "1"
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "10"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+
+# Об'єднання звернень до бота: максимальна кількість звернень, що надійшли під час обробки попередніх
+# і отримують одну спільну відповідь
+MENTION_COALESCE_MAX_BATCH = int(os.getenv("MENTION_COALESCE_MAX_BATCH", "5"))
+
+# Визначення настрою для відповіді смарт-агента:
+# parallel - окремий виклик класифікації тону паралельно зі збиранням історії та зображень,
+# inline - без окремого виклику: основна відповідь починається зі службового заголовка тону
+MOOD_DETECTION_MODE = os.getenv("MOOD_DETECTION_MODE", "parallel")
+
 # Channel ID for notifications
 CHANNEL_ID = os.getenv("CHANNEL_ID")
 
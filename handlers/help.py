@@ -12,6 +12,7 @@ async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         f"{EMOJIS['task']} /tasks - Керування завданнями\n"
         f"{EMOJIS['diagram']} /diagrams - Робота з діаграмами\n"
         f"{EMOJIS['settings']} /settings - Налаштування\n"
+        f"{EMOJIS['info']} /search - Пошук по історії чату\n"
         f"{EMOJIS['help']} /help - Довідка"
     )
     
@@ -1,122 +1,167 @@
+import logging
 from telegram import Update
 from telegram.ext import ContextTypes
-from typing import List, Optional
+from typing import Dict, List, Optional
+
+from utils.chat_history import ChatHistory, HistoryRecord, IMAGE_MESSAGE, TEXT_MESSAGE
+from utils.image_store import image_store
+from utils.history_summarizer import get_chat_summary, history_summarizer
+from utils.message_index import message_index
+from utils.vector_index import vector_index
 
 MAX_HISTORY = 30
 
+
+def get_chat_history(chat_data: Dict) -> ChatHistory:
+    """
+    Повертає історію чату (кільцевий буфер на MAX_HISTORY записів), створюючи її за потреби.
+    Усі записи в історію проходять через append_history_record().
+    """
+    history = chat_data.get('history')
+    if not isinstance(history, ChatHistory):
+        history = ChatHistory(MAX_HISTORY)
+        chat_data['history'] = history
+    return history
+
+
+def append_history_record(chat_data: Dict, record: HistoryRecord) -> None:
+    """
+    Єдина точка запису в історію: додає запис, звільняє зображення витісненого запису
+    і передає його рядок у фонове підсумовування
+    """
+    evicted = get_chat_history(chat_data).append(record)
+    if evicted is None:
+        return
+    if evicted.images:
+        for image_key in evicted.images:
+            image_store.release(image_key)
+    history_summarizer.add_evicted(chat_data, evicted.line, is_bot=evicted.is_bot)
+
+
+def get_history_prompt(chat_data: Dict, last_n: Optional[int] = None) -> str:
+    """
+    Повертає готовий блок історії '[username]: text' для останніх last_n записів
+    """
+    return get_chat_history(chat_data).prompt(last_n)
+
+
+def get_history_summary(chat_data: Dict) -> str:
+    """
+    Поточний підсумок давньої історії чату (порожній рядок, якщо історія ще не виходила за межі вікна)
+    """
+    return get_chat_summary(chat_data).text
+
+
+def index_message(chat_id: int, message_id: Optional[int], username: str, text: str,
+                  timestamp: Optional[float]) -> None:
+    """
+    Передає повідомлення в повнотекстовий (/search) і семантичний (вибір давніх повідомлень для контексту) індекси
+    """
+    message_index.add(chat_id, message_id, username, text, timestamp)
+    vector_index.add(chat_id, message_id, username, text, timestamp)
+
+
 async def history_logger(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Логування історії чату у context.chat_data['history'] (текстові повідомлення та фото з підписами).
     Тепер підтримує групування фото з підписами як одне повідомлення.
+    Кожне залоговане повідомлення також потрапляє в індекси пошуку (index_message).
     """
-    if not update.effective_message:
+    message = update.effective_message
+    if not message:
         return
-    
+
     # Пропускаємо команди
-    if update.effective_message.text and update.effective_message.text.startswith('/'):
+    if message.text and message.text.startswith('/'):
         return
-    
+
     # Обробляємо тільки текстові повідомлення або фото з підписами
-    if not update.effective_message.text and not (update.effective_message.photo and update.effective_message.caption):
+    if not message.text and not (message.photo and message.caption):
         return
-    
-    history = context.chat_data.get('history', [])
-    media_group_id = update.effective_message.media_group_id
-    
+
+    history = get_chat_history(context.chat_data)
+    media_group_id = message.media_group_id
+    username = update.effective_user.username or update.effective_user.first_name
+    timestamp = message.date.timestamp() if message.date else None
+
     # Якщо це фото з підписом
-    if update.effective_message.photo:
-        # Якщо це частина медіа-групи
-        if media_group_id:
-            # Шукаємо існуючий запис для цієї медіа-групи
-            existing_entry = None
-            for entry in reversed(history):
-                if entry.get('type') == 'image_message' and entry.get('media_group_id') == media_group_id:
-                    existing_entry = entry
-                    break
-            
-            if existing_entry:
-                # Додаємо фото до існуючого запису
-                existing_entry['image_count'] = existing_entry.get('image_count', 1) + 1
-                # Оновлюємо підпис якщо є новий
-                if update.effective_message.caption:
-                    existing_entry['text'] = update.effective_message.caption
-            else:
-                # Створюємо новий запис для медіа-групи
-                history.append({
-                    'type': 'image_message',
-                    'user_id': update.effective_user.id,
-                    'username': update.effective_user.username or update.effective_user.first_name,
-                    'text': update.effective_message.caption or '[Зображення]',
-                    'image_count': 1,
-                    'media_group_id': media_group_id,
-                    'message_id': update.effective_message.message_id,
-                    'timestamp': update.effective_message.date.isoformat() if update.effective_message.date else None
-                })
+    if message.photo:
+        # Якщо це частина медіа-групи, шукаємо існуючий запис через індекс
+        existing_record = history.find_media_group(media_group_id) if media_group_id else None
+
+        if existing_record:
+            # Додаємо фото до існуючого запису
+            existing_record.image_count += 1
+            # Оновлюємо підпис якщо є новий
+            if message.caption:
+                existing_record.text = message.caption
+            history.touch(existing_record)
         else:
-            # Одиночне фото з підписом
-            history.append({
-                'type': 'image_message',
-                'user_id': update.effective_user.id,
-                'username': update.effective_user.username or update.effective_user.first_name,
-                'text': update.effective_message.caption or '[Зображення]',
-                'image_count': 1,
-                'message_id': update.effective_message.message_id,
-                'timestamp': update.effective_message.date.isoformat() if update.effective_message.date else None
-            })
-    
+            # Новий запис для медіа-групи або одиночного фото з підписом
+            append_history_record(context.chat_data, HistoryRecord(
+                type=IMAGE_MESSAGE,
+                user_id=update.effective_user.id,
+                username=username,
+                text=message.caption or '[Зображення]',
+                image_count=1,
+                media_group_id=media_group_id,
+                message_id=message.message_id,
+                timestamp=timestamp
+            ))
+        if message.caption:
+            index_message(update.effective_chat.id, message.message_id, username, message.caption, timestamp)
+
     # Якщо це звичайне текстове повідомлення
-    elif update.effective_message.text:
-        history.append({
-            'type': 'text_message',
-            'user_id': update.effective_user.id,
-            'username': update.effective_user.username or update.effective_user.first_name,
-            'text': update.effective_message.text,
-            'message_id': update.effective_message.message_id,
-            'timestamp': update.effective_message.date.isoformat() if update.effective_message.date else None
-        })
-    
-    # Обрізаємо до MAX_HISTORY
-    history = history[-MAX_HISTORY:]
-    context.chat_data['history'] = history
-
-
-def add_image_message_to_history(context: ContextTypes.DEFAULT_TYPE, images: List[str], 
-                                 caption: str, user_id: int, username: str, 
-                                 media_group_id: Optional[str] = None, 
+    elif message.text:
+        append_history_record(context.chat_data, HistoryRecord(
+            type=TEXT_MESSAGE,
+            user_id=update.effective_user.id,
+            username=username,
+            text=message.text,
+            message_id=message.message_id,
+            timestamp=timestamp
+        ))
+        index_message(update.effective_chat.id, message.message_id, username, message.text, timestamp)
+
+
+def add_image_message_to_history(context: ContextTypes.DEFAULT_TYPE, image_keys: List[str],
+                                 caption: str, user_id: int, username: str,
+                                 media_group_id: Optional[str] = None,
                                  message_id: Optional[int] = None,
-                                 timestamp: Optional[str] = None) -> None:
+                                 timestamp: Optional[float] = None) -> None:
     """
     Додає повідомлення з зображеннями до історії чату.
     Використовується smart_agent.py для додавання групових зображень.
+    Історія тримає лише ключі image_store (по одному посиланню на кожне зображення).
     ВАЖЛИВО: НЕ викликати для зображень від бота (user_id не повинен бути None)
     """
-    if 'history' not in context.chat_data:
-        context.chat_data['history'] = []
-    
     # Захист: не зберігаємо зображення від бота
     if user_id is None:
         logging.warning(f"[HISTORY] Відхилено спробу зберегти зображення від бота в історію")
         return
-    
-    history = context.chat_data['history']
-    
-    # Створюємо запис для зображень
-    image_entry = {
-        'type': 'image_message',
-        'user_id': user_id,
-        'username': username,
-        'text': caption or f'[{len(images)} зображень]',
-        'image_count': len(images),
-        'images': images,  # Store the actual base64 image data
-        'message_id': message_id,
-        'timestamp': timestamp
-    }
-    
-    if media_group_id:
-        image_entry['media_group_id'] = media_group_id
-    
-    history.append(image_entry)
-    
-    # Обрізаємо до MAX_HISTORY
-    history = history[-MAX_HISTORY:]
-    context.chat_data['history'] = history
+
+    image_keys = [key for key in image_keys if image_store.acquire(key)]
+
+    append_history_record(context.chat_data, HistoryRecord(
+        type=IMAGE_MESSAGE,
+        user_id=user_id,
+        username=username,
+        text=caption or f'[{len(image_keys)} зображень]',
+        image_count=len(image_keys),
+        images=image_keys,
+        media_group_id=media_group_id,
+        message_id=message_id,
+        timestamp=timestamp
+    ))
+
+
+def add_bot_reply_to_history(context: ContextTypes.DEFAULT_TYPE, bot_username: str, text: str) -> None:
+    """
+    Додає відповідь бота до історії чату (без статус-префікса, щоб уникнути дублювання)
+    """
+    append_history_record(context.chat_data, HistoryRecord(
+        type=TEXT_MESSAGE,
+        user_id=None,
+        username=bot_username,
+        text=text
+    ))
@@ -0,0 +1,33 @@
+import html
+import time
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from config import EMOJIS, SEARCH_RESULTS_LIMIT
+from utils.message_index import SNIPPET_END, SNIPPET_START, message_index
+
+
+def format_search_result(position: int, result) -> str:
+    """Рядок результату: номер, дата, автор і фрагмент з виділеними збігами"""
+    when = time.strftime('%d.%m.%Y %H:%M', time.localtime(result.timestamp)) if result.timestamp else '?'
+    snippet = html.escape(result.snippet).replace(SNIPPET_START, '<b>').replace(SNIPPET_END, '</b>')
+    return f"{position}. <i>{when}</i> <b>{html.escape(result.username or '?')}</b>: {snippet}"
+
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обробник команди /search: пошук по історії чату з ранжуванням за релевантністю"""
+    query = " ".join(context.args or []).strip()
+    if not query:
+        await update.effective_message.reply_text(
+            f"{EMOJIS['info']} Використання: /search <слова для пошуку>"
+        )
+        return
+
+    results = await message_index.search(update.effective_chat.id, query, limit=SEARCH_RESULTS_LIMIT)
+    if not results:
+        await update.effective_message.reply_text(f"{EMOJIS['warning']} Нічого не знайдено за запитом: {query}")
+        return
+
+    lines = [f"{EMOJIS['info']} <b>Результати пошуку</b> ({html.escape(query)}):", ""]
+    lines.extend(format_search_result(position, result) for position, result in enumerate(results, 1))
+    await update.effective_message.reply_text("\n".join(lines), parse_mode='HTML')
@@ -1,35 +1,63 @@
-from telegram import Update
+from telegram import Message, Update
 from telegram.ext import ContextTypes
-import re
-import base64
-import io
+from telegram.error import BadRequest
 import os
 import asyncio
 from typing import Dict, List, Optional
 import time
 
 import logging
-from telegram.constants import MessageEntityType
-from openai import AsyncOpenAI
-from config import OPENAI_API_KEY, get_system_prompt
-from .history_logger import add_image_message_to_history
-from utils.mood_manager import MoodManager
+from config import (
+    BOT_REPLY_MAX_TOKENS, CONTEXT_RECENT_RECORDS, MOOD_DETECTION_MODE, RETRIEVAL_TOP_K, SEMANTIC_MIN_SCORE,
+    SEMANTIC_TOP_K, STREAMING_REPLIES, get_system_prompt
+)
+from .history_logger import (
+    add_image_message_to_history, add_bot_reply_to_history, get_chat_history, get_history_prompt, get_history_summary
+)
+from utils.mood_manager import (
+    MOOD_CONFIG, MoodManager, ToneHeaderStream, format_tone_header, parse_tone_header, tone_header_instruction
+)
+from utils.mention_filter import bot_mention
+from utils.streaming import TELEGRAM_CAPTION_LIMIT, StreamingReply
+from utils.llm_gateway import llm_gateway
+from utils.image_store import image_store
+from utils.media_group import MediaGroupAggregator
+from utils.mention_queue import ChatRequestQueue
+from utils.context_builder import build_context, context_budget
+from utils.message_index import message_index, refers_to_past
+from utils.vector_index import vector_index
+from utils.token_estimate import truncate_to_tokens
+from utils.response_cache import history_fingerprint, response_cache, response_cache_key
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-
-# Global mood manager instance
+# Global mood manager: per-chat mood state in a bounded LRU, shared tone memo
 mood_manager = MoodManager()
 
-# Глобальний буфер для групування медіафайлів
-media_group_buffer: Dict[str, Dict] = {}
-
 # Буфер для нещодавніх зображень від користувачів (для контекстного реагування)
-# Структура: {user_id: [{'image_base64': str, 'caption': str, 'timestamp': float, 'message_id': int}, ...]}
+# Структура: {user_id: [{'image_key': str, 'caption': str, 'timestamp': float, 'message_id': int}, ...]}
+# Самі байти зберігаються в image_store, буфер тримає лише ключі
 user_recent_images: Dict[int, List[Dict]] = {}
 
-def store_image_in_buffer(user_id: int, image_base64: str, caption: str = "", message_id: int = None) -> None:
+# Фонові задачі (наприклад, попереднє завантаження зображень, що не знадобились через кеш відповідей)
+_background_tasks = set()
+
+
+def keep_in_background(task: asyncio.Task) -> None:
+    """Тримає посилання на задачу до її завершення, щоб її не зібрав GC"""
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def build_image_parts(bot, image_keys: List[str]) -> List[Dict]:
+    """
+    Паралельно завантажує та готує (зменшення, перекодування, detail) зображення зі сховища
+    і формує image_url частини контенту. base64 формується лише тут, при побудові запиту.
+    """
+    parts = await asyncio.gather(*(image_store.image_part(bot, key) for key in image_keys))
+    return [part for part in parts if part]
+
+
+def store_image_in_buffer(user_id: int, image_key: str, caption: str = "", message_id: int = None) -> None:
     """
-    Зберігає зображення в буфер нещодавніх зображень користувача
+    Зберігає посилання на зображення в буфер нещодавніх зображень користувача
     ВАЖЛИВО: НЕ зберігаємо зображення від бота (user_id=None або від бота)
     """
     global user_recent_images
@@ -43,228 +71,416 @@ def store_image_in_buffer(user_id: int, image_base64: str, caption: str = "", me
         user_recent_images[user_id] = []
     
     # Додаємо нове зображення
+    if not image_store.acquire(image_key):
+        return
     user_recent_images[user_id].append({
-        'image_base64': image_base64,
+        'image_key': image_key,
         'caption': caption,
         'timestamp': time.time(),
         'message_id': message_id
     })
     
     # Обмежуємо кількість зображень на користувача (максимум 5)
+    for dropped in user_recent_images[user_id][:-5]:
+        image_store.release(dropped['image_key'])
     user_recent_images[user_id] = user_recent_images[user_id][-5:]
     
     logging.warning(f"[IMAGE_BUFFER] Збережено зображення для користувача {user_id}, всього: {len(user_recent_images[user_id])}")
 
 
+class PendingMention:
+    """Звернення до бота, що чекає в черзі чату"""
+    __slots__ = ('update', 'context', 'message_id', 'user_id', 'user_name', 'question')
+
+    def __init__(self, update: Update, context: ContextTypes.DEFAULT_TYPE, message_id: int, user_id: int,
+                 user_name: str, question: str):
+        self.update = update
+        self.context = context
+        self.message_id = message_id
+        self.user_id = user_id
+        self.user_name = user_name
+        self.question = question
+
+
 async def smart_agent_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handler для смарт-агента: реагує на згадку бота в групі.
+    Звернення ставиться в чергу чату; звернення, що прийшли майже одночасно, отримують одну спільну відповідь.
     """
-    global user_recent_images
-    
-    bot_username = (await context.bot.get_me()).username
     message_text = update.effective_message.text or ""
+    # Фільтр bot_mention вже відсіяв повідомлення без згадки, перевірка лише для захисту
+    if not bot_mention.matches(message_text):
+        return
+
     chat_id = update.effective_chat.id
     message_id = update.effective_message.message_id
-    user_id = update.effective_user.id
 
     # Логування для діагностики
-    logging.warning(f"[SMART_AGENT] username: {bot_username}, message: {message_text}, chat_id: {chat_id}, message_id: {message_id}")
+    logging.warning(f"[SMART_AGENT] username: {context.bot.username}, message: {message_text}, chat_id: {chat_id}, message_id: {message_id}")
+    
+    mention_queue.submit(chat_id, PendingMention(
+        update=update,
+        context=context,
+        message_id=message_id,
+        user_id=update.effective_user.id,
+        user_name=update.effective_user.username or update.effective_user.first_name,
+        # Поточне питання (без згадки бота)
+        question=bot_mention.strip_mention(message_text),
+    ))
+
+
+async def answer_mentions(chat_id: int, mentions: List[PendingMention]) -> None:
+    """
+    Одна відповідь на пакет звернень з одного чату (зазвичай пакет з одного звернення).
+    Відповідь надсилається як reply на останнє звернення.
+    """
+    global user_recent_images
     
-    mentioned = False
-    entities = getattr(update.effective_message, 'entities', None)
-    if entities:
-        for ent in entities:
-            if ent.type in ("mention", MessageEntityType.MENTION):
-                entity_text = message_text[ent.offset:ent.offset+ent.length]
-                logging.warning(f"[SMART_AGENT] entity_text: {entity_text}")
-                if entity_text.lower() == f"@{bot_username.lower()}":
-                    mentioned = True
-    # Додатково перевіряємо regex по тексту
-    if re.search(rf"@{bot_username}\\b", message_text):
-        logging.warning("[SMART_AGENT] regex спрацював")
-        mentioned = True
-
-    if mentioned:
-        # --- Формування історії чату для промпта ---
-        history = context.chat_data.get('history', [])[-30:]
-        history_prompt = ""
+    context = mentions[-1].context
+    bot_username = context.bot.username
+    message_id = mentions[-1].message_id
+    
+    # --- Питання: одне звернення як є, кілька - з іменами авторів ---
+    if len(mentions) == 1:
+        user_question = mentions[0].question
+        question_block = f"Питання: {user_question}"
+    else:
+        user_question = "\n".join(f"[{mention.user_name}]: {mention.question}" for mention in mentions)
+        question_block = (
+            "Кілька звернень до тебе поспіль. Дай одну відповідь, яка відповідає кожному з них:\n"
+            f"{user_question}"
+        )
+
+    # --- Mood detection: не блокує збирання історії та завантаження зображень ---
+    # inline: ключові слова локально, а якщо вони мовчать - тон повідомляє сама основна відповідь
+    # parallel: класифікація тону (можливо, виклик OpenAI) стартує одразу і виконується паралельно
+    tone_inline = False
+    mood_task = None
+    if MOOD_DETECTION_MODE == 'inline':
+        keyword_mood = mood_manager.keyword_mood(chat_id, user_question)
+        if keyword_mood is not None:
+            current_mood, temperature, mood_emoji = mood_manager.set_mood(chat_id, keyword_mood)
+        else:
+            tone_inline = True
+            current_mood = mood_manager.get_current_mood(chat_id)
+            temperature = MOOD_CONFIG[current_mood]['temperature']
+    else:
+        mood_task = asyncio.create_task(mood_manager.update_mood(chat_id, user_question, use_ai=True))
+
+    image_task = None
+    try:
+        # --- Історія чату: записи з готовими рядками та оцінкою токенів (оновлюються в history_logger) ---
+        history_records = get_chat_history(context.chat_data).recent()
+        # Підсумок давнішої розмови (фіксована невелика ціна замість довшого вікна)
+        history_summary = get_history_summary(context.chat_data)
+        summary_block = f"Підсумок давнішої розмови:\n{history_summary}\n\n" if history_summary else ""
+        # Давніші повідомлення беруться не всі підряд, а лише схожі за змістом на питання
+        # (семантичний індекс; для питань про давніше обговорення - ще й точні збіги слів з повнотекстового)
+        context_records = history_records[-CONTEXT_RECENT_RECORDS:]
+        known_ids = {record.message_id for record in context_records if record.message_id is not None}
+        known_ids.update(mention.message_id for mention in mentions)
+        searches = [vector_index.search(
+            chat_id, [mention.question for mention in mentions],
+            limit=SEMANTIC_TOP_K, min_score=SEMANTIC_MIN_SCORE, exclude_message_ids=known_ids
+        )]
+        if RETRIEVAL_TOP_K > 0 and refers_to_past(user_question):
+            searches.append(message_index.search(
+                chat_id, user_question, limit=RETRIEVAL_TOP_K, exclude_message_ids=known_ids
+            ))
+        retrieved = {}
+        for results in await asyncio.gather(*searches):
+            for result in results:
+                retrieved.setdefault(result.message_id, result)
+        retrieved_block = ""
+        if retrieved:
+            retrieved_block = "Релевантні давніші повідомлення:\n" + "".join(
+                truncate_to_tokens(result.render().rstrip('\n'), BOT_REPLY_MAX_TOKENS) + '\n'
+                for result in sorted(retrieved.values(), key=lambda result: result.timestamp or 0)
+            ) + "\n"
+            logging.warning(f"[SMART_AGENT] Додано {len(retrieved)} давніших повідомлень з індексів")
+        image_notes = ""
         recent_images = []
-        
-        for msg in history:
-            username = msg.get('username', 'user')
-            text = msg.get('text', '')
-            msg_type = msg.get('type', 'text_message')
-            msg_user_id = msg.get('user_id')
-            
-            if msg_type == 'image_message':
-                image_count = msg.get('image_count', 1)
-                if image_count > 1:
-                    text = f"[{image_count} зображень] {text}"
-                else:
-                    text = f"[Зображення] {text}"
-                
-                # Collect recent images for GPT-4o - ONLY from real users, NOT from bot
-                images = msg.get('images', [])
-                if images and msg_user_id is not None:  # Only add images from real users (bot has user_id=None)
-                    recent_images.extend(images)
-            
-            history_prompt += f"[{username}]: {text}\n"
-        
-        # --- Перевіряємо нещодавні зображення від того ж користувача ---
+    
+        # Collect recent images for GPT-4o - ONLY from real users, NOT from bot (bot has user_id=None)
+        for record in history_records:
+            if record.images and not record.is_bot:
+                recent_images.extend(record.images)
+    
+        # --- Перевіряємо нещодавні зображення від авторів звернень ---
         # Очищаємо старі зображення (старше 60 секунд)
         current_time = time.time()
-        if user_id in user_recent_images:
-            user_recent_images[user_id] = [
-                img for img in user_recent_images[user_id] 
-                if current_time - img['timestamp'] <= 60
-            ]
-            
+        authors = {mention.user_id: mention.user_name for mention in mentions}
+        for user_id, user_name in authors.items():
+            if user_id not in user_recent_images:
+                continue
+            fresh_images = []
+            for img in user_recent_images[user_id]:
+                if current_time - img['timestamp'] <= 60:
+                    fresh_images.append(img)
+                else:
+                    image_store.release(img['image_key'])
+            user_recent_images[user_id] = fresh_images
+        
             # Додаємо нещодавні зображення від цього користувача
             if user_recent_images[user_id]:
                 logging.warning(f"[SMART_AGENT] Знайдено {len(user_recent_images[user_id])} нещодавніх зображень від користувача {user_id}")
                 for img_data in user_recent_images[user_id]:
-                    recent_images.append(img_data['image_base64'])
+                    recent_images.append(img_data['image_key'])
                     # Додаємо контекст про зображення в історію
                     caption = img_data.get('caption', '')
                     if caption:
-                        history_prompt += f"[{update.effective_user.username or update.effective_user.first_name}]: [Зображення] {caption}\n"
+                        image_notes += f"[{user_name}]: [Зображення] {caption}\n"
                     else:
-                        history_prompt += f"[{update.effective_user.username or update.effective_user.first_name}]: [Зображення]\n"
+                        image_notes += f"[{user_name}]: [Зображення]\n"
         # --- Системна інструкція ---
         system_instruction = get_system_prompt(bot_username)
-
-        # --- Поточне питання (без згадки бота) ---
-        user_question = message_text.replace(f"@{bot_username}", "").strip()
+        if tone_inline:
+            system_instruction += tone_header_instruction()
         logging.warning(f"[SMART_AGENT] Використовуємо уніфікований TARS-стиль промпт")
-
-        # --- Mood detection ---
-        current_mood, temperature, mood_emoji = await mood_manager.update_mood(user_question, use_ai=True)
+    
+        # Одне й те саме зображення може бути і в історії, і в буфері користувача - лишаємо унікальні ключі
+        # (порядок від старішого до новішого: при повторі лишається остання позиція)
+        recent_images = list(reversed(dict.fromkeys(
+            key for key in reversed(recent_images) if key in image_store
+        )))
+    
+        # --- Контекст під бюджет токенів моделі: зображення та історія від найновіших ---
+        # Зображення відбираються під бюджет gpt-4o; модель остаточно визначається за тим, що реально підготувалося
+        fixed_texts = (system_instruction, summary_block + retrieved_block + question_block + image_notes)
+        prompt_context = build_context(
+            context_records,
+            fixed_texts=fixed_texts,
+            budget=context_budget("gpt-4o" if recent_images else "gpt-4o-mini"),
+            image_candidates=[(key, image_store.dimensions(key)) for key in recent_images],
+        )
+    
+        # Зображення завантажуються та готуються паралельно з визначенням настрою
+        image_task = asyncio.create_task(asyncio.gather(*(
+            image_store.image_part(context.bot, key) for key in prompt_context.image_keys
+        ))) if prompt_context.image_keys else None
+        if mood_task is not None:
+            current_mood, temperature, mood_emoji = await mood_task
+        parts = await image_task if image_task is not None else []
+    except BaseException:
+        # Збирання контексту не вдалося (або відповідь скасовано) - фонові задачі не мають лишатися без власника
+        for task in (mood_task, image_task):
+            if task is not None and not task.done():
+                task.cancel()
+        raise
+    image_parts = [part for part in parts if part]
+    images_included = [key for key, part in zip(prompt_context.image_keys, parts) if part]
+    
+    # --- Модель: одна й та сама для бюджету, ключа кешу та запиту ---
+    model = "gpt-4o" if image_parts else "gpt-4o-mini"
+    if prompt_context.image_keys and not image_parts:
+        # Жодне зображення не підготувалося - контекст перебудовується під текстову модель
+        prompt_context = build_context(context_records, fixed_texts=fixed_texts, budget=context_budget(model))
+    logging.warning(f"[CONTEXT] {prompt_context.describe()}")
+    
+    # --- Формування запиту до OpenAI ---
+    user_content = (
+        f"{summary_block}"
+        f"{retrieved_block}"
+        f"Історія чату (останні {prompt_context.history_count}):\n"
+        f"{prompt_context.history_text}{image_notes}\n{question_block}"
+    )
+    
+    # --- Кеш відповідей: однакові питання з тим самим контекстом відповідаються миттєво ---
+    cache_key = response_cache_key(
+        model,
+        user_question,
+        temperature,
+        history_fingerprint(get_chat_history(context.chat_data), bot_mention),
+        images_included
+    )
+    cached_text = response_cache.get(cache_key)
+    logging.warning(f"[RESPONSE_CACHE] {'hit' if cached_text is not None else 'miss'}, {response_cache.stats()}")
+    if cached_text is not None and tone_inline:
+        # Закешована відповідь зберігається разом із заголовком тону
+        reported_mood, cached_text = parse_tone_header(cached_text)
+        if reported_mood is not None:
+            current_mood, temperature, mood_emoji = mood_manager.set_mood(chat_id, reported_mood)
+    
+    if cached_text is None:
+        # If there are recent images, use GPT-4o and include them
+        if image_parts:
+            # Create content with text and images
+            content = [{"type": "text", "text": user_content}] + image_parts
+            logging.warning(f"[SMART_AGENT] Використано GPT-4o з {len(image_parts)} зображеннями")
+        else:
+            # Use GPT-4o-mini for text-only
+            content = user_content
+            logging.warning(f"[SMART_AGENT] Використано GPT-4o-mini для тексту")
+        
+        request_kwargs = dict(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_instruction},
+                {"role": "user", "content": content}
+            ],
+            temperature=temperature,
+            max_tokens=512,
+        )
+    
+    status_prefix = mood_manager.get_status_prefix(current_mood, temperature)
+    
+    if cached_text is not None:
+        # --- Відповідь з кешу: без звернення до OpenAI ---
+        response_text = cached_text
+        try:
+            await send_mood_reply(context.bot, chat_id, message_id, current_mood, f"{status_prefix}\n{response_text}")
+        except Exception as e:
+            logging.error(f"[SMART_AGENT] Помилка при відправці відповіді: {e}")
+            return
+    elif STREAMING_REPLIES:
+        # --- Потокова відповідь: фото настрою з плейсхолдером одразу, далі редагування підпису по мірі генерації ---
+        reply = StreamingReply(context.bot, chat_id, reply_to_message_id=message_id)
+        tone_stream = ToneHeaderStream() if tone_inline else None
+        started_mood = current_mood
+        # Плейсхолдер надсилається окремо: помилка Telegram тут - це помилка відправки, а не OpenAI
+        try:
+            await reply.start(send=lambda placeholder: send_mood_reply(
+                context.bot, chat_id, message_id, started_mood, placeholder
+            ))
+        except Exception as e:
+            logging.error(f"[SMART_AGENT] Помилка при відправці відповіді: {e}")
+            return
+        try:
+            async for delta in llm_gateway.stream(**request_kwargs):
+                if tone_stream is not None:
+                    delta = tone_stream.feed(delta)
+                if delta:
+                    reply.push(delta)
+            if tone_stream is not None:
+                tail = tone_stream.flush()
+                if tail:
+                    reply.push(tail)
+                current_mood, temperature, mood_emoji = mood_manager.set_mood(chat_id, tone_stream.mood or current_mood)
+                status_prefix = mood_manager.get_status_prefix(current_mood, temperature)
+            response_text = reply.text.strip()
+            if response_text:
+                response_cache.set(cache_key, format_tone_header(current_mood) + response_text if tone_inline else response_text)
+            logging.warning(f"[SMART_AGENT] Відповідь OpenAI (stream): {response_text}")
+        except Exception as e:
+            response_text = f"⚠️ Помилка при зверненні до OpenAI: {e}"
+            logging.error(f"[SMART_AGENT] OpenAI error: {e}")
         
+        try:
+            # Настрій змінився під час генерації - фото замінюється разом із фінальним підписом
+            photo = mood_avatar_media(current_mood) if current_mood != started_mood else None
+            edited = await reply.finish(f"{status_prefix}\n{response_text}", photo=photo)
+            if edited is not None and edited.photo:
+                mood_manager.remember_avatar(current_mood, edited.photo[-1].file_id)
+        except Exception as e:
+            logging.error(f"[SMART_AGENT] Помилка при відправці відповіді: {e}")
+            return
+    else:
         # --- Відправка запиту до OpenAI ---
         response_text = None
         try:
-            # Prepare user content
-            user_content = f"Історія чату (останні 30):\n{history_prompt}\nПитання: {user_question}"
-            
-            # If there are recent images, use GPT-4o and include them
-            if recent_images:
-                # Limit to last 3 images to avoid token limits
-                images_to_include = recent_images[-3:]
-                
-                # Create content with text and images
-                content = [{"type": "text", "text": user_content}]
-                
-                for image_base64 in images_to_include:
-                    content.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_base64}"
-                        }
-                    })
-                
-                response = await client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {"role": "system", "content": system_instruction},
-                        {"role": "user", "content": content}
-                    ],
-                    temperature=temperature,
-                    max_tokens=512,
-                )
-                logging.warning(f"[SMART_AGENT] Використано GPT-4o з {len(images_to_include)} зображеннями")
-            else:
-                # Use GPT-4o-mini for text-only
-                response = await client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": system_instruction},
-                        {"role": "user", "content": user_content}
-                    ],
-                    temperature=temperature,
-                    max_tokens=512,
-                )
-                logging.warning(f"[SMART_AGENT] Використано GPT-4o-mini для тексту")
-            
+            response = await llm_gateway.complete(**request_kwargs)
             response_text = response.choices[0].message.content.strip()
+            if tone_inline:
+                reported_mood, response_text = parse_tone_header(response_text)
+                current_mood, temperature, mood_emoji = mood_manager.set_mood(chat_id, reported_mood or current_mood)
+                status_prefix = mood_manager.get_status_prefix(current_mood, temperature)
+                response_text = response_text.strip()
+            if response_text:
+                response_cache.set(cache_key, format_tone_header(current_mood) + response_text if tone_inline else response_text)
             logging.warning(f"[SMART_AGENT] Відповідь OpenAI: {response_text}")
         except Exception as e:
             response_text = f"⚠️ Помилка при зверненні до OpenAI: {e}"
             logging.error(f"[SMART_AGENT] OpenAI error: {e}")
 
-        # --- Відправляємо відповідь у чат ---
+        # --- Відправляємо відповідь у чат (з фото настрою) ---
         try:
-            # Add mood status prefix to response
-            status_prefix = mood_manager.get_status_prefix(current_mood, temperature)
-            final_response = f"{status_prefix}\n{response_text}"
-            
-            # Send photo with mood along with text response
-            if mood_manager.mood_image_exists(current_mood):
-                mood_image_path = mood_manager.get_mood_image_path(current_mood)
-                with open(mood_image_path, 'rb') as photo:
-                    await context.bot.send_photo(
-                        chat_id=chat_id,
-                        photo=photo,
-                        caption=final_response,
-                        reply_to_message_id=message_id
-                    )
-                logging.warning(f"[SMART_AGENT] Відповідь з фото настрою {current_mood} відправлено!")
-            else:
-                # Fallback to text-only if image not found
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=final_response,
-                    reply_to_message_id=message_id
-                )
-                logging.warning(f"[SMART_AGENT] Відповідь без фото відправлено (фото {current_mood} не знайдено)!")
-            # --- Додаємо відповідь бота в історію ---
-            if 'history' not in context.chat_data:
-                context.chat_data['history'] = []
-            context.chat_data['history'].append({
-                'type': 'text_message',
-                'user_id': None,
-                'username': bot_username,
-                'text': response_text,  # Store without status prefix to avoid duplication
-                'message_id': None,
-                'timestamp': None
-            })
-            context.chat_data['history'] = context.chat_data['history'][-30:]
+            await send_mood_reply(context.bot, chat_id, message_id, current_mood, f"{status_prefix}\n{response_text}")
         except Exception as e:
             logging.error(f"[SMART_AGENT] Помилка при відправці відповіді: {e}")
+            return
+
+    if cached_text is None:
+        logging.warning(f"[LLM_GATEWAY] {llm_gateway.stats()}")
 
+    # --- Додаємо відповідь бота в історію ---
+    add_bot_reply_to_history(context, bot_username, response_text)
 
-def is_bot_mentioned(message_text: str, bot_username: str, entities: Optional[List] = None) -> bool:
+
+async def send_mood_reply(bot, chat_id: int, reply_to_message_id: Optional[int], mood: str, text: str) -> Message:
     """
-    Перевіряє чи згадано бота в повідомленні
+    Надсилає відповідь з фото настрою (або лише текст, якщо фото немає).
+    Аватар вивантажується в Telegram один раз, далі надсилається за збереженим file_id.
+    Текст, що не вміщується в підпис до фото, надсилається окремим повідомленням у відповідь.
+    Повертає надіслане повідомлення
     """
-    if not message_text:
-        return False
-        
-    # Перевіряємо entities
-    if entities:
-        for ent in entities:
-            if ent.type in ("mention", MessageEntityType.MENTION):
-                entity_text = message_text[ent.offset:ent.offset+ent.length]
-                if entity_text.lower() == f"@{bot_username.lower()}":
-                    return True
+    caption, rest = text[:TELEGRAM_CAPTION_LIMIT], text[TELEGRAM_CAPTION_LIMIT:]
+    message = None
+    file_id = mood_manager.get_avatar_file_id(mood)
+    if file_id is not None:
+        try:
+            message = await bot.send_photo(
+                chat_id=chat_id,
+                photo=file_id,
+                caption=caption,
+                reply_to_message_id=reply_to_message_id
+            )
+            logging.warning(f"[SMART_AGENT] Відповідь з фото настрою {mood} відправлено (file_id)!")
+        except BadRequest as e:
+            # file_id більше не дійсний (наприклад, змінився токен бота) - вивантажуємо файл заново
+            logging.error(f"[SMART_AGENT] file_id аватара {mood} відхилено: {e}")
+            mood_manager.forget_avatar(mood)
     
-    # Додатково перевіряємо regex
-    if re.search(rf"@{bot_username}\b", message_text):
-        return True
+    if message is None and mood_manager.mood_image_exists(mood):
+        mood_image_path = mood_manager.get_mood_image_path(mood)
+        with open(mood_image_path, 'rb') as photo:
+            message = await bot.send_photo(
+                chat_id=chat_id,
+                photo=photo,
+                caption=caption,
+                reply_to_message_id=reply_to_message_id
+            )
+        if message.photo:
+            mood_manager.remember_avatar(mood, message.photo[-1].file_id)
+        logging.warning(f"[SMART_AGENT] Відповідь з фото настрою {mood} відправлено!")
+    elif message is None:
+        # Fallback to text-only if image not found
+        message = await bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            reply_to_message_id=reply_to_message_id
+        )
+        logging.warning(f"[SMART_AGENT] Відповідь без фото відправлено (фото {mood} не знайдено)!")
+        return message
     
-    return False
+    if rest.strip():
+        await bot.send_message(chat_id=chat_id, text=rest, reply_to_message_id=message.message_id)
+    return message
+
 
+def mood_avatar_media(mood: str):
+    """Фото настрою для заміни в уже надісланому повідомленні: збережений file_id або байти файлу (None - фото немає)"""
+    file_id = mood_manager.get_avatar_file_id(mood)
+    if file_id is not None:
+        return file_id
+    if mood_manager.mood_image_exists(mood):
+        with open(mood_manager.get_mood_image_path(mood), 'rb') as photo:
+            return photo.read()
+    return None
 
-async def process_grouped_images(media_group_id: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+def release_group_images(media_group_id: str, group_data: Dict) -> None:
     """
-    Обробляє групу зображень після збору всіх фото
+    Знімає посилання буфера медіа-групи на зображення (група оброблена або покинута)
     """
-    global media_group_buffer
-    
-    if media_group_id not in media_group_buffer:
-        return
-    
-    group_data = media_group_buffer[media_group_id]
+    for image_key in group_data['images']:
+        image_store.release(image_key)
+
+
+async def process_grouped_images(media_group_id: str, group_data: Dict) -> None:
+    """
+    Обробляє групу зображень після збору всіх фото (викликається агрегатором медіа-груп)
+    """
+    context = group_data['context']
     bot_username = group_data['bot_username']
     chat_id = group_data['chat_id']
     images = group_data['images']
@@ -277,17 +493,12 @@ async def process_grouped_images(media_group_id: str, context: ContextTypes.DEFA
     # Перевіряємо чи бота згадано
     if not mentioned:
         logging.warning(f"[PHOTO_HANDLER] Бота не згадано в групі {media_group_id}, пропускаємо")
-        del media_group_buffer[media_group_id]
+        release_group_images(media_group_id, group_data)
         return
     
     try:
-        # Отримуємо останні 5 повідомлень як контекст
-        history = context.chat_data.get('history', [])[-5:]
-        context_text = ""
-        for msg in history:
-            username = msg.get('username', 'user')
-            text = msg.get('text', '')
-            context_text += f"[{username}]: {text}\n"
+        # Останні 5 повідомлень як контекст (готовий блок з кешу історії)
+        context_text = get_history_prompt(context.chat_data, last_n=5)
         
         # Системна інструкція
         system_instruction = get_system_prompt(bot_username)
@@ -302,24 +513,18 @@ async def process_grouped_images(media_group_id: str, context: ContextTypes.DEFA
         else:
             prompt_text += "Проаналізуй зображення з урахуванням контексту повідомлень та дай відповідь."
         
-        # Формуємо контент для OpenAI
-        content = [{"type": "text", "text": prompt_text}]
-        
-        # Додаємо всі зображення
-        for image_base64 in images:
-            content.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{image_base64}"
-                }
-            })
-        
-        # Detect mood from caption and context
+        # Зображення завантажуються з Telegram лише зараз, паралельно з визначенням настрою за підписом
         mood_text = caption or "зображення"
-        current_mood, temperature, mood_emoji = await mood_manager.update_mood(mood_text, use_ai=True)
+        image_parts, (current_mood, temperature, mood_emoji) = await asyncio.gather(
+            build_image_parts(context.bot, images),
+            mood_manager.update_mood(chat_id, mood_text, use_ai=True),
+        )
+        
+        # Формуємо контент для OpenAI
+        content = [{"type": "text", "text": prompt_text}] + image_parts
         
         # Відправляємо запит до GPT-4o
-        response = await client.chat.completions.create(
+        response = await llm_gateway.complete(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": system_instruction},
@@ -337,40 +542,15 @@ async def process_grouped_images(media_group_id: str, context: ContextTypes.DEFA
         final_response = f"{status_prefix}\n{response_text}"
         
         # Відправляємо відповідь у чат з фото настрою
-        if mood_manager.mood_image_exists(current_mood):
-            mood_image_path = mood_manager.get_mood_image_path(current_mood)
-            with open(mood_image_path, 'rb') as photo:
-                await context.bot.send_photo(
-                    chat_id=chat_id,
-                    photo=photo,
-                    caption=final_response,
-                    reply_to_message_id=first_message_id
-                )
-        else:
-            # Fallback to text-only if image not found
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=final_response,
-                reply_to_message_id=first_message_id
-            )
+        await send_mood_reply(context.bot, chat_id, first_message_id, current_mood, final_response)
         
         # Додаємо відповідь бота в історію
-        if 'history' not in context.chat_data:
-            context.chat_data['history'] = []
-        context.chat_data['history'].append({
-            'type': 'text_message',
-            'user_id': None,
-            'username': bot_username,
-            'text': response_text,  # Store without status prefix to avoid duplication
-            'message_id': None,
-            'timestamp': None
-        })
-        context.chat_data['history'] = context.chat_data['history'][-30:]
+        add_bot_reply_to_history(context, bot_username, response_text)
         
         # Додаємо запис про групове зображення в історію
         add_image_message_to_history(
             context=context,
-            images=images,
+            image_keys=images,
             caption=caption,
             user_id=group_data.get('user_id'),
             username=group_data.get('username', 'user'),
@@ -394,9 +574,8 @@ async def process_grouped_images(media_group_id: str, context: ContextTypes.DEFA
             logging.error(f"[PHOTO_HANDLER] Помилка при відправці повідомлення про помилку: {send_error}")
     
     finally:
-        # Видаляємо групу з буфера
-        if media_group_id in media_group_buffer:
-            del media_group_buffer[media_group_id]
+        # Знімаємо посилання буфера групи на зображення
+        release_group_images(media_group_id, group_data)
 
 
 async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -404,9 +583,7 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     Handler для обробки фотографій з контекстом тексту через GPT-4o
     Тепер підтримує групування медіафайлів та реагує тільки на згадки бота
     """
-    global media_group_buffer
-    
-    bot_username = (await context.bot.get_me()).username
+    bot_username = context.bot.username
     chat_id = update.effective_chat.id
     message_id = update.effective_message.message_id
     caption = update.effective_message.caption or ""
@@ -415,77 +592,67 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     logging.warning(f"[PHOTO_HANDLER] Отримано фото в чаті {chat_id}, media_group_id={media_group_id}")
     
     # Перевіряємо згадку бота в підписі
-    mentioned = is_bot_mentioned(caption, bot_username, update.effective_message.entities)
+    mentioned = bot_mention.matches(caption)
     
     try:
-        # Отримуємо найбільшу версію фото
-        photo = update.effective_message.photo[-1]
-        
-        # Завантажуємо фото
-        file = await context.bot.get_file(photo.file_id)
-        
-        # Завантажуємо файл в пам'ять
-        file_data = io.BytesIO()
-        await file.download_to_memory(file_data)
-        file_data.seek(0)
-        
-        # Кодуємо в base64
-        image_base64 = base64.b64encode(file_data.read()).decode('utf-8')
+        # Нічого не завантажуємо: реєструємо лише file_id та розміри всіх PhotoSize.
+        # Байти буде завантажено (оптимального розміру) тільки коли фото знадобиться для запиту до LLM
+        photo_sizes = update.effective_message.photo
+        image_key = image_store.register(
+            photo_sizes[-1].file_unique_id,
+            [(size.file_id, size.width, size.height) for size in photo_sizes]
+        )
         
         # Якщо це частина медіа-групи
         if media_group_id:
-            # Ініціалізуємо групу якщо не існує
-            if media_group_id not in media_group_buffer:
-                media_group_buffer[media_group_id] = {
-                    'bot_username': bot_username,
-                    'chat_id': chat_id,
-                    'images': [],
-                    'caption': caption,
-                    'mentioned': mentioned,
-                    'first_message_id': message_id,
-                    'last_update': asyncio.get_event_loop().time(),
-                    'user_id': update.effective_user.id,
-                    'username': update.effective_user.username or update.effective_user.first_name,
-                    'timestamp': update.effective_message.date.isoformat() if update.effective_message.date else None
-                }
+            # Агрегатор створює групу при першому фото та переносить її єдиний таймер з кожним наступним.
+            # Продовження групи, що вже завершилася (фото запізнилися), успадковує її підпис і згадку бота
+            group_data = media_groups.add(media_group_id, chat_id, lambda previous: {
+                'bot_username': bot_username,
+                'chat_id': chat_id,
+                'context': context,
+                'images': [],
+                'caption': caption or (previous['caption'] if previous else ''),
+                'mentioned': mentioned or bool(previous and previous['mentioned']),
+                'first_message_id': message_id,
+                'user_id': update.effective_user.id,
+                'username': update.effective_user.username or update.effective_user.first_name,
+                'timestamp': update.effective_message.date.timestamp() if update.effective_message.date else None
+            })
             
-            # Додаємо зображення до групи
-            media_group_buffer[media_group_id]['images'].append(image_base64)
+            # Додаємо зображення до групи (посилання хендлера переходить до буфера групи)
+            group_data['images'].append(image_key)
             
             # Також зберігаємо в буфер користувача для контекстного реагування
             user_id = update.effective_user.id
-            store_image_in_buffer(user_id, image_base64, caption, message_id)
+            store_image_in_buffer(user_id, image_key, caption, message_id)
             
             # Оновлюємо згадку та підпис (якщо в поточному повідомленні є згадка)
-            if mentioned and not media_group_buffer[media_group_id]['mentioned']:
-                media_group_buffer[media_group_id]['mentioned'] = True
-            
-            if caption and not media_group_buffer[media_group_id]['caption']:
-                media_group_buffer[media_group_id]['caption'] = caption
-            
-            media_group_buffer[media_group_id]['last_update'] = asyncio.get_event_loop().time()
+            if mentioned and not group_data['mentioned']:
+                group_data['mentioned'] = True
             
-            # Запускаємо таймер для обробки групи (2 секунди затримки)
-            await asyncio.sleep(2)
+            if caption and not group_data['caption']:
+                group_data['caption'] = caption
             
-            # Перевіряємо чи група ще існує та чи минуло достатньо часу
-            if (media_group_id in media_group_buffer and 
-                asyncio.get_event_loop().time() - media_group_buffer[media_group_id]['last_update'] >= 1.5):
-                await process_grouped_images(media_group_id, context)
+            # Хендлер завершується одразу: групу обробить таймер агрегатора
         
         # Якщо це окреме фото (не частина групи)
         else:
             # Зберігаємо зображення в буфер навіть якщо бота не згадано
             user_id = update.effective_user.id
-            store_image_in_buffer(user_id, image_base64, caption, message_id)
+            store_image_in_buffer(user_id, image_key, caption, message_id)
             
-            # Перевіряємо чи бота згадано
-            if not mentioned:
-                logging.warning(f"[PHOTO_HANDLER] Бота не згадано в одиночному фото, зберігаємо в буфер")
-                return
-            
-            # Обробляємо як одиночне фото
-            await process_single_image(image_base64, caption, chat_id, message_id, bot_username, context)
+            try:
+                # Перевіряємо чи бота згадано
+                if not mentioned:
+                    logging.warning(f"[PHOTO_HANDLER] Бота не згадано в одиночному фото, зберігаємо в буфер")
+                    return
+                
+                # Обробляємо як одиночне фото
+                await process_single_image(image_key, caption, chat_id, message_id, bot_username, context)
+            finally:
+                # Буфер користувача тримає власне посилання, посилання хендлера більше не потрібне
+                image_store.release(image_key)
         
     except Exception as e:
         error_text = f"⚠️ Помилка при обробці зображення: {e}"
@@ -501,18 +668,13 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
                 logging.error(f"[PHOTO_HANDLER] Помилка при відправці повідомлення про помилку: {send_error}")
 
 
-async def process_single_image(image_base64: str, caption: str, chat_id: int, message_id: int, bot_username: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def process_single_image(image_key: str, caption: str, chat_id: int, message_id: int, bot_username: str, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Обробляє одиночне зображення
     """
     try:
-        # Отримуємо останні 5 повідомлень як контекст
-        history = context.chat_data.get('history', [])[-5:]
-        context_text = ""
-        for msg in history:
-            username = msg.get('username', 'user')
-            text = msg.get('text', '')
-            context_text += f"[{username}]: {text}\n"
+        # Останні 5 повідомлень як контекст (готовий блок з кешу історії)
+        context_text = get_history_prompt(context.chat_data, last_n=5)
         
         # Системна інструкція
         system_instruction = get_system_prompt(bot_username)
@@ -523,26 +685,23 @@ async def process_single_image(image_base64: str, caption: str, chat_id: int, me
             prompt_text += f"Підпис до зображення: {caption}\n"
         prompt_text += "Проаналізуй зображення з урахуванням контексту повідомлень та дай відповідь."
         
-        # Detect mood from caption and context
+        # Завантажуємо зображення з Telegram лише зараз, паралельно з визначенням настрою за підписом
         mood_text = caption or "зображення"
-        current_mood, temperature, mood_emoji = await mood_manager.update_mood(mood_text, use_ai=True)
+        image_parts, (current_mood, temperature, mood_emoji) = await asyncio.gather(
+            build_image_parts(context.bot, [image_key]),
+            mood_manager.update_mood(chat_id, mood_text, use_ai=True),
+        )
+        if not image_parts:
+            raise RuntimeError("не вдалося завантажити зображення")
         
         # Відправляємо запит до GPT-4o з зображенням
-        response = await client.chat.completions.create(
+        response = await llm_gateway.complete(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": system_instruction},
                 {
                     "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt_text},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
-                            }
-                        }
-                    ]
+                    "content": [{"type": "text", "text": prompt_text}] + image_parts
                 }
             ],
             temperature=temperature,
@@ -557,35 +716,10 @@ async def process_single_image(image_base64: str, caption: str, chat_id: int, me
         final_response = f"{status_prefix}\n{response_text}"
         
         # Відправляємо відповідь у чат з фото настрою
-        if mood_manager.mood_image_exists(current_mood):
-            mood_image_path = mood_manager.get_mood_image_path(current_mood)
-            with open(mood_image_path, 'rb') as photo:
-                await context.bot.send_photo(
-                    chat_id=chat_id,
-                    photo=photo,
-                    caption=final_response,
-                    reply_to_message_id=message_id
-                )
-        else:
-            # Fallback to text-only if image not found
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=final_response,
-                reply_to_message_id=message_id
-            )
+        await send_mood_reply(context.bot, chat_id, message_id, current_mood, final_response)
         
         # Додаємо відповідь бота в історію
-        if 'history' not in context.chat_data:
-            context.chat_data['history'] = []
-        context.chat_data['history'].append({
-            'type': 'text_message',
-            'user_id': None,
-            'username': bot_username,
-            'text': response_text,  # Store without status prefix to avoid duplication
-            'message_id': None,
-            'timestamp': None
-        })
-        context.chat_data['history'] = context.chat_data['history'][-30:]
+        add_bot_reply_to_history(context, bot_username, response_text)
         
         logging.warning(f"[PHOTO_HANDLER] Відповідь на одиночне фото відправлено!")
         
@@ -600,3 +734,15 @@ async def process_single_image(image_base64: str, caption: str, chat_id: int, me
             )
         except Exception as send_error:
             logging.error(f"[PHOTO_HANDLER] Помилка при відправці повідомлення про помилку: {send_error}")
+
+
+# Один таймер на медіа-групу замість сну в кожному хендлері фото
+media_groups = MediaGroupAggregator(on_complete=process_grouped_images, on_discard=release_group_images)
+
+# Черга звернень: звернення, що надійшли під час відповіді в чаті, об'єднуються; не більше однієї відповіді в польоті на чат
+# Відповіді запускаються через Application.create_task з update звернення: помилки йдуть в error handler,
+# дані чату після відповіді позначаються для збереження, а зупинка бота дочікується незавершених відповідей
+mention_queue = ChatRequestQueue(
+    process=answer_mentions,
+    create_task=lambda coro, mention: mention.context.application.create_task(coro, update=mention.update),
+)
@@ -1,7 +1,9 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters, CallbackQueryHandler
 from config import EMOJIS
-from utils.jira_client import jira_client
+from utils.jira_client import async_jira_client
+from utils.issue_cache import issue_cache
 
 # Імпортуємо стани з start
 from .start import MAIN_MENU, TASKS, DIAGRAMS, SETTINGS
@@ -9,11 +11,16 @@ from .start import MAIN_MENU, TASKS, DIAGRAMS, SETTINGS
 # Стани для ConversationHandler
 TASK_ACTION, CREATE_TASK_SUMMARY, CREATE_TASK_DESCRIPTION = range(3)
 
+# Переглядач завдань: кнопки з callback_data 'issues:<дія>'; у user_data зберігається стек курсорів
+# переглянутих сторінок (перший - None, останній - поточна сторінка), бо курсори Jira Cloud ведуть лише вперед
+ISSUES_CALLBACK_PATTERN = r'^issues:(first|prev|next|refresh)$'
+ISSUES_CURSOR_KEY = 'issues_cursor'
+
 import os
 
 async def tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Головне меню завдань"""
-    if not jira_client.is_connected():
+    if not await async_jira_client.ensure_connected():
         if update.message:
             await update.message.reply_text(
                 f"{EMOJIS['error']} Помилка підключення до Jira. "
@@ -26,8 +33,8 @@ async def tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             )
         return MAIN_MENU
     
-    # Отримуємо задачі з Jira
-    issues_text = jira_client.get_my_issues()
+    # Отримуємо задачі з Jira (з кешу; Jira опитується не частіше за JIRA_CACHE_TTL)
+    issues_text = await issue_cache.get_text()
 
     # Виводимо chat_id для діагностики
     print(f"chat_id: {update.effective_chat.id}")
@@ -43,11 +50,16 @@ async def tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     else:
         confirmation = f"{EMOJIS['error']} Не вказано CHANNEL_ID у .env"
 
+    reply_markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"{EMOJIS['task']} Переглянути завдання", callback_data='issues:first')],
+        [InlineKeyboardButton(f"{EMOJIS['back']} Назад", callback_data='back')],
+    ])
+
     # Відповідаємо користувачу-початківцю
     if update.message:
-        await update.message.reply_text(confirmation)
+        await update.message.reply_text(confirmation, reply_markup=reply_markup)
     elif update.callback_query:
-        await update.callback_query.edit_message_text(confirmation)
+        await update.callback_query.edit_message_text(confirmation, reply_markup=reply_markup)
 
     return TASK_ACTION
 
@@ -60,24 +72,8 @@ async def task_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     if query.data == 'my_tasks':
-        try:
-            issues = jira_client.get_my_issues()
-            await query.edit_message_text(
-                issues,
-                parse_mode='Markdown',
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton(f"{EMOJIS['back']} Назад", callback_data='back')]
-                ])
-            )
-            return MAIN_MENU
-        except Exception as e:
-            await query.edit_message_text(
-                f"{EMOJIS['error']} Помилка отримання завдань: {str(e)}",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton(f"{EMOJIS['back']} Назад", callback_data='back')]
-                ])
-            )
-            return MAIN_MENU
+        await show_issues_page(query, context, 'first')
+        return MAIN_MENU
         
     elif query.data == 'create_task':
         await query.edit_message_text(
@@ -94,6 +90,73 @@ async def task_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     return TASK_ACTION
 
+def issues_page_keyboard(page, has_prev: bool) -> InlineKeyboardMarkup:
+    """Кнопки переглядача: попередня/наступна сторінка (якщо є), оновити, назад"""
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("◀️ Попередня", callback_data='issues:prev'))
+    if page is not None and page.has_next:
+        navigation.append(InlineKeyboardButton("Наступна ▶️", callback_data='issues:next'))
+    keyboard = [navigation] if navigation else []
+    keyboard.append([
+        InlineKeyboardButton("🔄 Оновити", callback_data='issues:refresh'),
+        InlineKeyboardButton(f"{EMOJIS['back']} Назад", callback_data='back'),
+    ])
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def show_issues_page(query, context: ContextTypes.DEFAULT_TYPE, action: str) -> None:
+    """Показує сторінку завдань у повідомленні з кнопками, зсуваючи стек курсорів у user_data відповідно до action"""
+    cursors = context.user_data.get(ISSUES_CURSOR_KEY)
+    if action == 'first' or not isinstance(cursors, list) or not cursors:
+        cursors = [None]
+    cursors = list(cursors)
+    if action == 'refresh':
+        issue_cache.invalidate()
+
+    page = None
+    try:
+        if not await async_jira_client.ensure_connected():
+            raise ConnectionError("Не вдалося підключитися до Jira")
+        if action == 'next':
+            current = await issue_cache.get_page(cursors[-1])
+            if current.has_next:
+                cursors.append(current.next_token)
+        elif action == 'prev' and len(cursors) > 1:
+            cursors.pop()
+        page = await issue_cache.get_page(cursors[-1])
+        # Список зменшився, поки користувач гортав - повертаємося на попередню сторінку
+        if len(cursors) > 1 and not page.issues:
+            cursors.pop()
+            page = await issue_cache.get_page(cursors[-1])
+        context.user_data[ISSUES_CURSOR_KEY] = cursors
+        text = async_jira_client.format_page(page, len(cursors))
+        parse_mode = 'Markdown'
+    except Exception as e:
+        # Текст помилки Jira часто містить _, * або [ - надсилаємо його без розмітки
+        text = f"{EMOJIS['error']} Помилка отримання завдань: {getattr(e, 'text', None) or e}"
+        parse_mode = None
+
+    try:
+        await query.edit_message_text(
+            text,
+            parse_mode=parse_mode,
+            reply_markup=issues_page_keyboard(page, len(cursors) > 1),
+            disable_web_page_preview=True
+        )
+    except BadRequest as e:
+        # Повторне натискання тієї самої кнопки - сторінка не змінилася
+        if 'not modified' not in str(e).lower():
+            raise
+
+
+async def issues_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обробник кнопок переглядача завдань (issues:first/prev/next/refresh)"""
+    query = update.callback_query
+    await query.answer()
+    await show_issues_page(query, context, query.data.split(':', 1)[1])
+
+
 async def create_task_summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробка введення короткого опису завдання"""
     if not update.message or not update.message.text:
@@ -129,7 +192,8 @@ async def create_task_description(update: Update, context: ContextTypes.DEFAULT_
         return CREATE_TASK_SUMMARY
     
     try:
-        issue_key = jira_client.create_issue(summary, description)
+        issue_key = await async_jira_client.create_issue(summary, description)
+        issue_cache.invalidate()
         await update.message.reply_text(
             f"{EMOJIS['success']} Завдання створено: {issue_key}\n"
             f"{EMOJIS['task']} {summary}",
@@ -183,4 +247,6 @@ tasks_conv_handler = ConversationHandler(
         CREATE_TASK_DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, create_task_description)],
     },
     fallbacks=[CommandHandler('cancel', cancel)],
+    name='tasks_conversation',
+    persistent=True,
 )
\ No newline at end of file
@@ -1,11 +1,12 @@
 import logging
 import os
+import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, MessageHandler,
     filters, ContextTypes, ConversationHandler
 )
-from config import BOT_TOKEN, ADMIN_IDS, EMOJIS
+from config import BOT_TOKEN, ADMIN_IDS, EMOJIS, ensure_data_dirs
 
 # Імпортуємо стани з handlers
 from handlers import MAIN_MENU, TASKS, DIAGRAMS, SETTINGS, tasks_conv_handler
@@ -14,9 +15,18 @@ from handlers import MAIN_MENU, TASKS, DIAGRAMS, SETTINGS, tasks_conv_handler
 from handlers.start import start
 from handlers.help import show_help
 from handlers.button_handler import button_handler
-from handlers.tasks import tasks  # Імпортуємо функцію tasks з модуля tasks
-from handlers.smart_agent import smart_agent_handler, photo_handler
+from handlers.tasks import tasks, issues_page_handler, ISSUES_CALLBACK_PATTERN  # Імпортуємо функцію tasks з модуля tasks
+from handlers.smart_agent import smart_agent_handler, photo_handler, mood_manager
 from handlers.history_logger import history_logger
+from handlers.search import search_command
+from utils.message_index import message_index
+from utils.vector_index import vector_index
+from utils.image_store import image_store
+from utils.jira_client import async_jira_client
+from utils.issue_cache import issue_cache
+from utils.llm_gateway import llm_gateway
+from utils.mention_filter import bot_mention
+from utils.sqlite_persistence import SQLitePersistence
 
 # Налаштування логування
 logging.basicConfig(
@@ -96,10 +106,44 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
             f"{EMOJIS['error']} Сталася помилка. Будь ласка, спробуйте пізніше."
         )
 
+async def post_init(application: Application) -> None:
+    """Ініціалізація після старту: ім'я бота визначаємо один раз (get_me вже викликано в initialize)"""
+    bot_mention.set_username(application.bot.username)
+    # Настрій чатів зберігається в bot_data, щоб переживати перезапуск
+    mood_manager.bind_store(application.bot_data.setdefault('moods', {}))
+    # Вивантажені на диск зображення попереднього запуску вже нікому не належать
+    await asyncio.to_thread(image_store.clear_spill_dir)
+    # Важкі SDK та мережеві підключення - у фоні, не затримуючи початок обробки оновлень
+    application.create_task(warm_up(), name='warm_up')
+    logger.info(f"Бот ініціалізовано як @{application.bot.username}")
+
+async def warm_up() -> None:
+    """Фоновий прогрів: імпорт SDK OpenAI, логін у Jira та перше завантаження списку завдань"""
+    started = asyncio.get_running_loop().time()
+    await asyncio.to_thread(llm_gateway.warm_up)
+    if await async_jira_client.ensure_connected():
+        await issue_cache.get_text()
+    logger.info(f"Прогрів завершено за {asyncio.get_running_loop().time() - started:.1f} с")
+
+async def post_shutdown(application: Application) -> None:
+    """Зупинка: дописуємо в індекси повідомлення, що ще чекають на пакетний запис, і зупиняємо пул Jira"""
+    await message_index.close()
+    await vector_index.close()
+    async_jira_client.shutdown()
+
 def main() -> None:
     """Запуск бота"""
+    ensure_data_dirs()
     # Створюємо додаток
-    application = Application.builder().token(BOT_TOKEN).build()
+    # chat_data (історія, підсумок), user_data, bot_data та стани розмов зберігаються в SQLite
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .persistence(SQLitePersistence())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Додаємо обробник команди /start
     application.add_handler(CommandHandler("start", start))
@@ -109,7 +153,13 @@ def main() -> None:
     
     # Додаємо обробник команди /tasks
     application.add_handler(CommandHandler("tasks", tasks))
+
+    # Додаємо обробник команди /search (повнотекстовий пошук по історії чату)
+    application.add_handler(CommandHandler("search", search_command))
     
+    # Додаємо обробник кнопок переглядача завдань (до загального обробника кнопок, який приймає все)
+    application.add_handler(CallbackQueryHandler(issues_page_handler, pattern=ISSUES_CALLBACK_PATTERN))
+
     # Додаємо обробник кнопок (має бути після команд)
     application.add_handler(CallbackQueryHandler(button_handler))
 
@@ -119,8 +169,8 @@ def main() -> None:
     # Додаємо handler для фотографій (обробляє фото з контекстом)
     application.add_handler(MessageHandler(filters.PHOTO, photo_handler), group=1)
 
-    # Додаємо handler смарт-агента (реагує на тег бота в тексті)
-    application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), smart_agent_handler), group=2)
+    # Додаємо handler смарт-агента (реагує на тег бота в тексті; повідомлення без згадки відсікає фільтр)
+    application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND) & bot_mention, smart_agent_handler), group=2)
 
     # Додаємо ConversationHandler для завдань (має бути після звичайних обробників)
     application.add_handler(tasks_conv_handler)
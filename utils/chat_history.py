@@ -0,0 +1,119 @@
+from typing import Dict, Iterator, List, Optional
+
+from utils.token_estimate import estimate_text_tokens
+
+# Типи записів історії
+TEXT_MESSAGE = 'text_message'
+IMAGE_MESSAGE = 'image_message'
+
+
+class HistoryRecord:
+    """
+    Компактний запис історії чату (__slots__ замість dict).
+    timestamp зберігається як unix-час (float), рядок промпта рендериться один раз і кешується в line
+    разом з оцінкою його токенів у tokens.
+    """
+
+    __slots__ = ('type', 'user_id', 'username', 'text', 'image_count', 'images',
+                 'media_group_id', 'message_id', 'timestamp', 'line', 'tokens')
+
+    def __init__(self, type: str, user_id: Optional[int], username: str, text: str,
+                 image_count: int = 0, images: Optional[List] = None,
+                 media_group_id: Optional[str] = None, message_id: Optional[int] = None,
+                 timestamp: Optional[float] = None):
+        self.type = type
+        self.user_id = user_id
+        self.username = username or 'user'
+        self.text = text or ''
+        self.image_count = image_count
+        self.images = images
+        self.media_group_id = media_group_id
+        self.message_id = message_id
+        self.timestamp = timestamp
+        self.line = self.render()
+        self.tokens = estimate_text_tokens(self.line)
+
+    @property
+    def is_bot(self) -> bool:
+        """Записи бота не мають user_id"""
+        return self.user_id is None
+
+    def render(self) -> str:
+        """Форматує запис у рядок промпта виду '[username]: text'"""
+        text = self.text
+        if self.type == IMAGE_MESSAGE:
+            if self.image_count > 1:
+                text = f"[{self.image_count} зображень] {text}"
+            else:
+                text = f"[Зображення] {text}"
+        return f"[{self.username}]: {text}\n"
+
+
+class ChatHistory:
+    """
+    Історія чату фіксованої місткості: кільцевий буфер записів HistoryRecord
+    з O(1) індексом media_group_id та кешем готових блоків промпта.
+    Пам'ять на чат обмежена capacity записами незалежно від активності чату.
+    """
+
+    __slots__ = ('capacity', '_buffer', '_start', '_size', '_media_groups', '_blocks')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buffer: List[Optional[HistoryRecord]] = [None] * capacity
+        self._start = 0
+        self._size = 0
+        self._media_groups: Dict[str, HistoryRecord] = {}
+        self._blocks: Dict[Optional[int], str] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[HistoryRecord]:
+        """Записи від найстарішого до найновішого"""
+        for i in range(self._size):
+            yield self._buffer[(self._start + i) % self.capacity]
+
+    def append(self, record: HistoryRecord) -> Optional[HistoryRecord]:
+        """
+        Додає запис; якщо буфер заповнений, перезаписує найстаріший і повертає його
+        """
+        evicted = None
+        if self._size < self.capacity:
+            self._buffer[(self._start + self._size) % self.capacity] = record
+            self._size += 1
+        else:
+            evicted = self._buffer[self._start]
+            self._buffer[self._start] = record
+            self._start = (self._start + 1) % self.capacity
+            if evicted.media_group_id and self._media_groups.get(evicted.media_group_id) is evicted:
+                del self._media_groups[evicted.media_group_id]
+
+        if record.media_group_id:
+            self._media_groups[record.media_group_id] = record
+        self._blocks.clear()
+        return evicted
+
+    def find_media_group(self, media_group_id: str) -> Optional[HistoryRecord]:
+        """Повертає запис медіа-групи за O(1)"""
+        return self._media_groups.get(media_group_id)
+
+    def touch(self, record: HistoryRecord) -> None:
+        """Перерендерює запис після зміни на місці (нове фото в медіа-групі, новий підпис)"""
+        record.line = record.render()
+        record.tokens = estimate_text_tokens(record.line)
+        self._blocks.clear()
+
+    def recent(self, last_n: Optional[int] = None) -> List[HistoryRecord]:
+        """Останні last_n записів (або всі) від старішого до новішого"""
+        count = self._size if last_n is None else min(last_n, self._size)
+        first = self._size - count
+        return [self._buffer[(self._start + i) % self.capacity] for i in range(first, self._size)]
+
+    def prompt(self, last_n: Optional[int] = None) -> str:
+        """Готовий блок історії для промпта (кешується до наступної зміни)"""
+        cached = self._blocks.get(last_n)
+        if cached is None:
+            cached = ''.join(record.line for record in self.recent(last_n))
+            self._blocks[last_n] = cached
+        return cached
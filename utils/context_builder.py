@@ -0,0 +1,93 @@
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from config import BOT_REPLY_MAX_TOKENS, CONTEXT_IMAGE_SHARE, CONTEXT_TOKEN_BUDGETS, MAX_CONTEXT_IMAGES
+from utils.image_preprocess import choose_detail
+from utils.token_estimate import MESSAGE_OVERHEAD_TOKENS, estimate_image_tokens, estimate_text_tokens, truncate_to_tokens
+
+# Бюджет для моделей, яких немає в CONTEXT_TOKEN_BUDGETS
+DEFAULT_CONTEXT_BUDGET = 4000
+
+
+class PromptContext:
+    """Результат підбору контексту під бюджет токенів"""
+
+    __slots__ = ('budget', 'history_text', 'history_count', 'history_tokens', 'truncated_replies',
+                 'image_keys', 'image_tokens', 'fixed_tokens')
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.history_text = ''
+        self.history_count = 0
+        self.history_tokens = 0
+        self.truncated_replies = 0
+        self.image_keys: List[str] = []
+        self.image_tokens = 0
+        self.fixed_tokens = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.fixed_tokens + self.history_tokens + self.image_tokens
+
+    def describe(self) -> str:
+        """Рядок для логування оцінки токенів запиту"""
+        return (
+            f"~{self.total_tokens}/{self.budget} токенів: фіксована частина ~{self.fixed_tokens}, "
+            f"історія {self.history_count} записів ~{self.history_tokens} "
+            f"(обрізано відповідей бота: {self.truncated_replies}), "
+            f"зображень {len(self.image_keys)} ~{self.image_tokens}"
+        )
+
+
+def context_budget(model: str) -> int:
+    return CONTEXT_TOKEN_BUDGETS.get(model, DEFAULT_CONTEXT_BUDGET)
+
+
+def build_context(records: Sequence, fixed_texts: Iterable[str], budget: int,
+                  image_candidates: Sequence[Tuple[str, Optional[Tuple[int, int]]]] = ()) -> PromptContext:
+    """
+    Підбирає контекст запиту під бюджет токенів.
+    Фіксована частина (системний промпт, питання) враховується завжди. Далі зображення від найновішого
+    (не більше MAX_CONTEXT_IMAGES і не більше CONTEXT_IMAGE_SHARE бюджету), потім історія від найновішого
+    запису до найстарішого. Якщо вся історія не вміщується, спершу обрізаються відповіді бота.
+
+    records - записи історії від старішого до новішого (HistoryRecord з line та tokens),
+    image_candidates - (ключ, розміри або None) від старішого до новішого.
+    """
+    context = PromptContext(budget)
+    context.fixed_tokens = sum(estimate_text_tokens(text) + MESSAGE_OVERHEAD_TOKENS for text in fixed_texts)
+    remaining = budget - context.fixed_tokens
+
+    # --- Зображення ---
+    image_budget = min(remaining, int(budget * CONTEXT_IMAGE_SHARE))
+    selected = []
+    for key, size in reversed(image_candidates):
+        if len(selected) >= MAX_CONTEXT_IMAGES:
+            break
+        width, height = size if size else (None, None)
+        detail = choose_detail(width, height) if size else 'high'
+        cost = estimate_image_tokens(width, height, detail)
+        if context.image_tokens + cost > image_budget:
+            continue
+        selected.append(key)
+        context.image_tokens += cost
+    context.image_keys = selected[::-1]
+    remaining -= context.image_tokens
+
+    # --- Історія ---
+    full_cost = sum(record.tokens for record in records)
+    truncate_replies = full_cost > remaining
+    lines = []
+    for record in reversed(records):
+        line, cost = record.line, record.tokens
+        truncated = truncate_replies and record.is_bot and cost > BOT_REPLY_MAX_TOKENS
+        if truncated:
+            line = truncate_to_tokens(line.rstrip('\n'), BOT_REPLY_MAX_TOKENS) + '\n'
+            cost = estimate_text_tokens(line)
+        if context.history_tokens + cost > remaining:
+            break
+        lines.append(line)
+        context.history_tokens += cost
+        context.truncated_replies += truncated
+    context.history_text = ''.join(reversed(lines))
+    context.history_count = len(lines)
+    return context
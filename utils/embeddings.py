@@ -0,0 +1,120 @@
+import re
+import abc
+import zlib
+import math
+import asyncio
+from collections import Counter
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+from config import EMBEDDER, EMBEDDING_DIM, EMBEDDING_MODEL
+from utils.llm_gateway import llm_gateway
+
+_WORD_RE = re.compile(r"\w+(?:['’]\w+)*")
+# Службові слова, що не несуть змісту (інакше короткі повідомлення схожі між собою лише через них)
+STOP_WORDS = frozenset({
+    'і', 'й', 'та', 'а', 'але', 'в', 'у', 'на', 'з', 'із', 'зі', 'до', 'по', 'за', 'від', 'для', 'про', 'що', 'як',
+    'це', 'той', 'ця', 'ці', 'то', 'не', 'ні', 'так', 'чи', 'же', 'ж', 'би', 'б', 'вже', 'ще', 'ми', 'ви', 'ти',
+    'я', 'він', 'вона', 'вони', 'воно', 'мене', 'тебе', 'нас', 'вас', 'його', 'її', 'їх', 'там', 'тут', 'коли',
+    'бо', 'якщо', 'щодо', 'який', 'яка', 'яке', 'які', 'чому', 'де', 'хто', 'є', 'був', 'була', 'було', 'були',
+    'the', 'a', 'an', 'and', 'or', 'of', 'to', 'in', 'on', 'for', 'is', 'are', 'was', 'we', 'you', 'it', 'what',
+})
+# Ваги ознак хешувального ембедера: цілі слова, пари сусідніх слів, символьні n-грами (стійкі до відмінків)
+FEATURE_WEIGHTS = {'w': 1.0, 'b': 0.5, 'c': 0.3}
+CHAR_NGRAM_SIZES = (3, 4)
+
+
+class Embedder(abc.ABC):
+    """
+    Інтерфейс ембедера: name ідентифікує простір векторів (збережений індекс з іншим name перебудовується),
+    embed повертає матрицю (len(texts), dim) float32 з нормованими рядками (скалярний добуток = косинус)
+    """
+
+    name = 'base'
+    dim = 0
+
+    @abc.abstractmethod
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        ...
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder(Embedder):
+    """
+    Локальний ембедер без мережі та словника: ознаки (слова, пари слів, символьні n-грами слів)
+    хешуються у вектор фіксованої розмірності зі знаком (feature hashing), частоти - сублінійні.
+    Ловить перефразування зі спільними коренями слів ("порти блок-діаграми" ~ "порт на діаграмі блоків").
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f'hashing-{dim}'
+
+    @staticmethod
+    def _features(text: str) -> Counter:
+        """Частоти ознак тексту: 'w:слово', 'b:слово слово', 'c:n-грама'"""
+        words = [word for word in _WORD_RE.findall(text.lower().replace('’', "'")) if word not in STOP_WORDS]
+        features: Counter = Counter()
+        for word in words:
+            features['w:' + word] += 1
+            padded = f'<{word}>'
+            for size in CHAR_NGRAM_SIZES:
+                for start in range(len(padded) - size + 1):
+                    features['c:' + padded[start:start + size]] += 1
+        for first, second in zip(words, words[1:]):
+            features[f'b:{first} {second}'] += 1
+        return features
+
+    def embed_sync(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            features = self._features(text)
+            if not features:
+                continue
+            hashes = np.fromiter((zlib.crc32(feature.encode()) for feature in features), dtype=np.uint32,
+                                 count=len(features))
+            # Сублінійна частота з вагою типу ознаки
+            weights = np.fromiter((FEATURE_WEIGHTS[feature[0]] * (1.0 + math.log(count))
+                                   for feature, count in features.items()), dtype=np.float64, count=len(features))
+            # Молодші біти - позиція, старший - знак (колізії частково гасять одна одну)
+            signs = np.where(hashes >> 31, -1.0, 1.0)
+            matrix[row] = np.bincount(hashes % self.dim, weights=signs * weights, minlength=self.dim)
+        return _normalize(matrix)
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        # Хешування ознак пакета - чистий CPU, тому поза event loop
+        return await asyncio.to_thread(self.embed_sync, texts)
+
+
+class OpenAIEmbedder(Embedder):
+    """Ембедінги OpenAI (text-embedding-3-*) через спільний шлюз; розмірність задається параметром dimensions"""
+
+    def __init__(self, model: str = EMBEDDING_MODEL, dim: int = EMBEDDING_DIM):
+        self.model = model
+        self.dim = dim
+        self.name = f'openai-{model}-{dim}'
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        response = await llm_gateway.embed(model=self.model, input=list(texts), dimensions=self.dim)
+        vectors: List[List[float]] = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        return _normalize(np.asarray(vectors, dtype=np.float32))
+
+
+# Доступні ембедери: назва в конфігурації -> фабрика
+EMBEDDERS: Dict[str, Callable[[], Embedder]] = {
+    'hashing': HashingEmbedder,
+    'openai': OpenAIEmbedder,
+}
+
+
+def create_embedder(name: str = EMBEDDER) -> Embedder:
+    factory = EMBEDDERS.get(name)
+    if factory is None:
+        raise ValueError(f"Невідомий ембедер '{name}', доступні: {', '.join(EMBEDDERS)}")
+    return factory()
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from config import SUMMARY_BATCH_SIZE, SUMMARY_ENABLED, SUMMARY_MAX_TOKENS, SUMMARY_MODEL
+from utils.llm_gateway import llm_gateway
+from utils.token_estimate import truncate_to_tokens
+
+# Скільки токенів рядка витісненого запису йде в підсумовування (довгі відповіді бота обрізаються)
+EVICTED_LINE_MAX_TOKENS = 150
+# Якщо підсумовування не вдається, черга не росте безмежно: лишаються найновіші рядки
+MAX_PENDING_BATCHES = 3
+
+SUMMARY_SYSTEM_PROMPT = (
+    "Ти ведеш стислий підсумок розмови в робочому чаті. Тобі дають попередній підсумок і нові повідомлення, "
+    "що вийшли за межі вікна історії. Онови підсумок: збережи рішення, домовленості, відкриті питання, "
+    "важливі факти та хто що казав. Пиши українською, без вступів, не довше {max_tokens} токенів."
+)
+
+
+class ChatSummary:
+    """Поточний підсумок давньої історії чату та рядки, що ще чекають на підсумовування"""
+
+    __slots__ = ('text', 'pending', 'folded')
+
+    def __init__(self):
+        self.text = ''
+        self.pending: List[str] = []
+        # Скільки записів уже згорнуто в підсумок
+        self.folded = 0
+
+
+def get_chat_summary(chat_data: Dict) -> ChatSummary:
+    summary = chat_data.get('summary')
+    if not isinstance(summary, ChatSummary):
+        summary = ChatSummary()
+        chat_data['summary'] = summary
+    return summary
+
+
+class HistorySummarizer:
+    """
+    Фонове інкрементальне підсумовування: записи, витіснені з кільцевого буфера історії,
+    накопичуються в черзі чату і пакетами по batch_size згортаються в поточний підсумок окремим викликом LLM.
+    Виклик відбувається поза обробкою звернень; на чат одночасно працює не більше одного підсумовування.
+    """
+
+    def __init__(self, batch_size: int = SUMMARY_BATCH_SIZE, max_tokens: int = SUMMARY_MAX_TOKENS,
+                 model: str = SUMMARY_MODEL, enabled: bool = SUMMARY_ENABLED):
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.model = model
+        self.enabled = enabled
+        self._running: Dict[int, asyncio.Task] = {}
+
+    def add_evicted(self, chat_data: Dict, line: str, is_bot: bool = False) -> None:
+        """Додає рядок витісненого запису в чергу і, якщо набрався пакет, запускає підсумовування"""
+        if not self.enabled:
+            return
+        summary = get_chat_summary(chat_data)
+        if is_bot:
+            line = truncate_to_tokens(line.rstrip('\n'), EVICTED_LINE_MAX_TOKENS) + '\n'
+        summary.pending.append(line)
+        overflow = len(summary.pending) - self.batch_size * MAX_PENDING_BATCHES
+        if overflow > 0:
+            del summary.pending[:overflow]
+
+        if len(summary.pending) >= self.batch_size and id(summary) not in self._running:
+            try:
+                task = asyncio.get_running_loop().create_task(self._fold(summary))
+            except RuntimeError:
+                # Немає event loop (наприклад, відновлення історії при старті) - згорнемо з наступним пакетом
+                return
+            self._running[id(summary)] = task
+            task.add_done_callback(lambda _: self._running.pop(id(summary), None))
+
+    async def _fold(self, summary: ChatSummary) -> None:
+        """Згортає накопичені рядки в підсумок (поки в черзі є повні пакети)"""
+        while len(summary.pending) >= self.batch_size:
+            batch = summary.pending[:]
+            new_text = await self._summarize(summary.text, batch)
+            if new_text is None:
+                return
+            summary.text = new_text
+            # Поки йшов виклик, у черзі могли з'явитися нові рядки - прибираємо лише згорнуті
+            del summary.pending[:len(batch)]
+            summary.folded += len(batch)
+            logging.warning(
+                f"[HISTORY_SUMMARY] Згорнуто {len(batch)} записів, всього {summary.folded}, "
+                f"підсумок {len(summary.text)} символів"
+            )
+
+    async def _summarize(self, previous: str, lines: List[str]) -> Optional[str]:
+        user_content = (
+            f"Попередній підсумок:\n{previous or '(порожньо)'}\n\n"
+            f"Нові повідомлення:\n{''.join(lines)}"
+        )
+        try:
+            response = await llm_gateway.complete(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.format(max_tokens=self.max_tokens)},
+                    {"role": "user", "content": user_content}
+                ],
+                temperature=0.2,
+                max_tokens=self.max_tokens,
+            )
+            text = (response.choices[0].message.content or '').strip()
+            return text or None
+        except Exception as e:
+            logging.error(f"[HISTORY_SUMMARY] Не вдалося оновити підсумок: {e}")
+            return None
+
+
+# Глобальний підсумовувач історії
+history_summarizer = HistorySummarizer()
@@ -0,0 +1,74 @@
+import io
+import base64
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from config import IMAGE_JPEG_QUALITY, IMAGE_WORKERS, VISION_LOW_DETAIL_EDGE, VISION_MAX_EDGE
+
+# Окремий пул потоків для обробки зображень, щоб Pillow та base64 не блокували event loop
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='image-prep')
+
+
+class PreparedImage:
+    """Зображення, підготовлене для vision-запиту: перекодований JPEG та рівень detail"""
+
+    __slots__ = ('data', 'width', 'height', 'detail')
+
+    def __init__(self, data: bytes, width: int, height: int, detail: str):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.detail = detail
+
+
+def choose_detail(width: int, height: int, low_detail_edge: int = VISION_LOW_DETAIL_EDGE) -> str:
+    """Маленьким зображенням достатньо detail=low (фіксована невелика кількість токенів)"""
+    return 'low' if max(width, height) <= low_detail_edge else 'high'
+
+
+def _prepare_sync(data: bytes, max_edge: int, quality: int) -> PreparedImage:
+    """
+    Зменшує зображення до max_edge по довшій стороні, перекодовує в JPEG із заданою якістю
+    та відкидає метадані (EXIF тощо). Виконується в пулі потоків.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as source:
+        # Оригінал можна лишити лише якщо це JPEG без метаданих (EXIF з GPS та орієнтацією, XMP)
+        is_plain_jpeg = source.format == 'JPEG' and not any(name in source.info for name in ('exif', 'xmp'))
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        out = io.BytesIO()
+        # Без exif=... Pillow не переносить метадані в новий файл
+        image.save(out, format='JPEG', quality=quality, optimize=True)
+        width, height = image.size
+
+    prepared = out.getvalue()
+    # Якщо перекодування не зменшило файл (вже маленький JPEG без метаданих), лишаємо оригінал
+    if is_plain_jpeg and len(prepared) >= len(data) and max(width, height) < max_edge:
+        prepared = data
+    return PreparedImage(prepared, width, height, choose_detail(width, height))
+
+
+async def prepare_image(data: bytes, max_edge: int = VISION_MAX_EDGE, quality: int = IMAGE_JPEG_QUALITY) -> PreparedImage:
+    """Готує зображення для vision-запиту поза event loop"""
+    loop = asyncio.get_running_loop()
+    prepared = await loop.run_in_executor(_executor, _prepare_sync, data, max_edge, quality)
+    logging.warning(
+        f"[IMAGE_PREP] {len(data)} -> {len(prepared.data)} байт, "
+        f"{prepared.width}x{prepared.height}, detail={prepared.detail}"
+    )
+    return prepared
+
+
+def _encode_data_url(data: bytes) -> str:
+    return f"data:image/jpeg;base64,{base64.b64encode(data).decode('ascii')}"
+
+
+async def encode_data_url(data: bytes) -> str:
+    """base64 data URL для OpenAI, кодування теж поза event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _encode_data_url, data)
@@ -0,0 +1,319 @@
+import os
+import asyncio
+import hashlib
+import logging
+import itertools
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config import IMAGE_SPILL_DIR, IMAGE_STORE_MAX_MEMORY, VISION_MAX_EDGE
+from utils.image_preprocess import encode_data_url, prepare_image
+
+# Варіант розміру фото від Telegram: (file_id, width, height)
+PhotoVariant = Tuple[str, int, int]
+
+
+def content_key(data: bytes) -> str:
+    """Ключ зображення за вмістом (якщо немає file_unique_id від Telegram)"""
+    return hashlib.sha1(data).hexdigest()
+
+
+def select_photo_variant(variants: Sequence[PhotoVariant], max_edge: int = VISION_MAX_EDGE) -> PhotoVariant:
+    """
+    Обирає найменший PhotoSize, довша сторона якого покриває корисну для vision-моделі роздільність.
+    Якщо жоден не покриває - повертає найбільший.
+    """
+    by_area = sorted(variants, key=lambda v: v[1] * v[2])
+    for variant in by_area:
+        if max(variant[1], variant[2]) >= max_edge:
+            return variant
+    return by_area[-1]
+
+
+class ImageStore:
+    """
+    Контентно-адресоване сховище зображень.
+    Сирі байти кожного зображення зберігаються рівно один раз під ключем (file_unique_id або хеш вмісту),
+    власники (буфер нещодавніх зображень, історія чату, медіа-групи) тримають лише ключі та лічильник посилань.
+    Фото з Telegram реєструються ліниво (register): зберігаються лише file_id та розміри,
+    а байти завантажуються (fetch) тільки коли зображення справді потрібне для запиту до LLM.
+    Перед першим використанням у запиті зображення проходить препроцесинг (зменшення, перекодування,
+    вибір detail) у пулі потоків; результат замінює сирі байти і кешується до звільнення зображення.
+    Коли обсяг у пам'яті перевищує max_memory_bytes, найстаріші зображення вивантажуються на диск у spill_dir;
+    запис, читання та видалення файлів виконуються в потоках, не блокуючи event loop. Файли попереднього
+    запуску прибирає clear_spill_dir (викликається при старті бота).
+    base64 генерується лише при формуванні запиту (image_part).
+    """
+
+    def __init__(self, max_memory_bytes: int = IMAGE_STORE_MAX_MEMORY, spill_dir: Optional[str] = IMAGE_SPILL_DIR):
+        self.max_memory_bytes = max_memory_bytes
+        self.spill_dir = spill_dir
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._refcounts: Dict[str, int] = {}
+        self._variants: Dict[str, List[PhotoVariant]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._details: Dict[str, str] = {}
+        self._preparing: Dict[str, asyncio.Future] = {}
+        # Ключ -> файл на диску для вивантажених зображень; зображення, що саме записуються (ще в пам'яті)
+        self._spilled: Dict[str, str] = {}
+        self._spilling: Dict[str, bytes] = {}
+        self._spilling_bytes = 0
+        self._spill_ids = itertools.count()
+        self._io_tasks = set()
+        self._memory_bytes = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._refcounts
+
+    def put(self, key: Optional[str], data: bytes) -> str:
+        """
+        Зберігає зображення (якщо його ще немає) та додає одне посилання для викликача
+        """
+        if not key:
+            key = content_key(data)
+        if key in self._refcounts:
+            self._refcounts[key] += 1
+            return key
+
+        self._refcounts[key] = 1
+        self._store_bytes(key, data)
+        return key
+
+    def register(self, key: str, variants: Sequence[PhotoVariant]) -> str:
+        """
+        Реєструє фото без завантаження: лише file_id та розміри. Додає одне посилання для викликача
+        """
+        if key in self._refcounts:
+            self._refcounts[key] += 1
+            return key
+
+        self._refcounts[key] = 1
+        self._variants[key] = list(variants)
+        return key
+
+    def acquire(self, key: str) -> bool:
+        """Додає посилання на вже збережене зображення"""
+        if key not in self._refcounts:
+            return False
+        self._refcounts[key] += 1
+        return True
+
+    def release(self, key: str) -> None:
+        """Знімає посилання; коли посилань не лишилося, зображення видаляється"""
+        count = self._refcounts.get(key)
+        if count is None:
+            return
+        if count > 1:
+            self._refcounts[key] = count - 1
+            return
+
+        del self._refcounts[key]
+        self._variants.pop(key, None)
+        self._details.pop(key, None)
+        self._drop_bytes(key)
+
+    def dimensions(self, key: str, max_edge: int = VISION_MAX_EDGE) -> Optional[Tuple[int, int]]:
+        """
+        Розміри, з якими зображення піде у vision-запит (обраний PhotoSize, вписаний у max_edge),
+        без завантаження. None для зображень, збережених лише як байти.
+        """
+        variants = self._variants.get(key)
+        if not variants:
+            return None
+        _, width, height = select_photo_variant(variants, max_edge)
+        scale = min(1.0, max_edge / max(width, height))
+        return round(width * scale), round(height * scale)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Повертає сирі байти зображення (з пам'яті або з диска)"""
+        data = self._memory.get(key)
+        if data is not None:
+            return data
+        path = self._spilled.get(key)
+        if path is not None:
+            try:
+                return await asyncio.to_thread(_read_file, path)
+            except OSError as e:
+                logging.error(f"[IMAGE_STORE] Не вдалося прочитати {key} з диска: {e}")
+        return None
+
+    async def fetch(self, bot, key: str) -> Optional[bytes]:
+        """
+        Повертає байти зображення, за потреби завантажуючи оптимальний PhotoSize з Telegram.
+        Паралельні запити на той самий ключ об'єднуються в одне завантаження.
+        """
+        data = await self.get(key)
+        if data is not None or key not in self._variants:
+            return data
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            # shield: скасування одного з тих, хто чекає, не скасовує спільне завантаження
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            file_id, width, height = select_photo_variant(self._variants[key])
+            file = await bot.get_file(file_id)
+            data = bytes(await file.download_as_bytearray())
+            logging.warning(f"[IMAGE_STORE] Завантажено {key} ({width}x{height}, {len(data)} байт)")
+            # Зображення могли звільнити під час завантаження
+            if key in self._refcounts:
+                self._store_bytes(key, data)
+            future.set_result(data)
+            return data
+        except Exception as e:
+            logging.error(f"[IMAGE_STORE] Не вдалося завантажити {key}: {e}")
+            future.set_result(None)
+            return None
+        finally:
+            # Завантаження скасували разом із задачею-власником: інші, хто чекає, отримують None
+            if not future.done():
+                future.set_result(None)
+            del self._inflight[key]
+
+    async def prepare(self, bot, key: str) -> Optional[str]:
+        """
+        Гарантує, що в сховищі лежить підготовлена версія зображення, і повертає її рівень detail.
+        Результат кешується на ключ до звільнення зображення.
+        """
+        detail = self._details.get(key)
+        if detail is not None:
+            return detail
+
+        preparing = self._preparing.get(key)
+        if preparing is not None:
+            return await asyncio.shield(preparing)
+
+        future = asyncio.get_running_loop().create_future()
+        self._preparing[key] = future
+        try:
+            data = await self.fetch(bot, key)
+            if data is not None and key in self._refcounts:
+                try:
+                    prepared = await prepare_image(data)
+                    data, detail = prepared.data, prepared.detail
+                except Exception as e:
+                    logging.error(f"[IMAGE_STORE] Препроцесинг {key} не вдався, використовуємо оригінал: {e}")
+                    detail = 'auto'
+                # Сирі байти більше не потрібні - зберігаємо лише підготовлену версію
+                if key in self._refcounts:
+                    self._drop_bytes(key)
+                    self._store_bytes(key, data)
+                    self._details[key] = detail
+                else:
+                    detail = None
+            future.set_result(detail)
+            return detail
+        finally:
+            # Препроцесинг скасували разом із задачею-власником: інші, хто чекає, отримують None
+            if not future.done():
+                future.set_result(None)
+            del self._preparing[key]
+
+    async def image_part(self, bot, key: str) -> Optional[Dict]:
+        """Формує image_url частину контенту для OpenAI (base64 створюється тільки тут)"""
+        detail = await self.prepare(bot, key)
+        data = await self.get(key) if detail is not None else None
+        if data is None:
+            return None
+        return {
+            "type": "image_url",
+            "image_url": {"url": await encode_data_url(data), "detail": detail}
+        }
+
+    def _store_bytes(self, key: str, data: bytes) -> None:
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        self._spill_if_needed()
+
+    def _drop_bytes(self, key: str) -> None:
+        data = self._memory.pop(key, None)
+        if data is not None:
+            self._memory_bytes -= len(data)
+        path = self._spilled.pop(key, None)
+        if path is not None:
+            self._in_background(self._remove_spill(key, path))
+
+    def _in_background(self, coro) -> None:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._io_tasks.add(task)
+        task.add_done_callback(self._io_tasks.discard)
+
+    def _spill_if_needed(self) -> None:
+        """Починає вивантаження найстаріших зображень на диск, поки обсяг у пам'яті перевищує ліміт"""
+        if not self.spill_dir:
+            return
+        excess = self._memory_bytes - self._spilling_bytes - self.max_memory_bytes
+        # Найновіше зображення лишається в пам'яті
+        candidates = len(self._memory) - len(self._spilling) - 1
+        for key, data in self._memory.items():
+            if excess <= 0 or candidates <= 0:
+                break
+            if key in self._spilling:
+                continue
+            self._spilling[key] = data
+            self._spilling_bytes += len(data)
+            excess -= len(data)
+            candidates -= 1
+            path = os.path.join(self.spill_dir, f"{key}-{next(self._spill_ids)}.jpg")
+            self._in_background(self._write_spill(key, data, path))
+
+    async def _write_spill(self, key: str, data: bytes, path: str) -> None:
+        # Поки файл пишеться, байти лишаються в пам'яті і доступні через get
+        try:
+            await asyncio.to_thread(_write_file, path, data)
+        except OSError as e:
+            logging.error(f"[IMAGE_STORE] Не вдалося вивантажити {key} на диск: {e}")
+            return
+        finally:
+            del self._spilling[key]
+            self._spilling_bytes -= len(data)
+        if self._memory.get(key) is data:
+            del self._memory[key]
+            self._memory_bytes -= len(data)
+            self._spilled[key] = path
+        else:
+            # Зображення звільнили або замінили під час запису
+            await self._remove_spill(key, path)
+
+    @staticmethod
+    async def _remove_spill(key: str, path: str) -> None:
+        try:
+            await asyncio.to_thread(os.remove, path)
+        except OSError as e:
+            logging.warning(f"[IMAGE_STORE] Не вдалося видалити {key} з диска: {e}")
+
+    def clear_spill_dir(self) -> None:
+        """Видаляє файли, вивантажені попереднім запуском (список вивантажених живе лише в пам'яті)"""
+        if not self.spill_dir or not os.path.isdir(self.spill_dir):
+            return
+        current = set(self._spilled.values())
+        removed = 0
+        for name in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, name)
+            if path in current or not os.path.isfile(path):
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError as e:
+                logging.warning(f"[IMAGE_STORE] Не вдалося видалити {path}: {e}")
+        if removed:
+            logging.warning(f"[IMAGE_STORE] Видалено {removed} вивантажених файлів попереднього запуску")
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _write_file(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+# Глобальне сховище зображень
+image_store = ImageStore()
@@ -0,0 +1,142 @@
+import math
+import time
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from config import (
+    EMOJIS, JIRA_CACHE_MAX_STALE, JIRA_CACHE_TTL, JIRA_FULL_SYNC_INTERVAL, JIRA_ISSUES_SHOWN, JIRA_PAGE_SIZE,
+    JIRA_SYNC_LIMIT
+)
+from utils.jira_client import AsyncJiraClient, IssuePage, IssueSnapshot, async_jira_client
+from utils.ttl_cache import TTLCache
+
+# Статус, завдання в якому показуються у списку
+SHOWN_STATUS = 'to do'
+# Запас для дельти (хвилини): JQL має хвилинну точність, плюс можливе розходження годинників
+DELTA_OVERLAP_MINUTES = 2
+# Скільки сторінок переглядача завдань тримати в кеші
+MAX_CACHED_PAGES = 50
+
+
+class IssueCache:
+    """
+    Кешований список завдань Jira для кнопки "Завдання" та /tasks.
+
+    - Свіжий список (молодший за ttl) віддається з пам'яті разом із готовим Markdown.
+    - Застарілий, але молодший за max_stale, теж віддається одразу, а оновлення запускається у фоні
+      (stale-while-revalidate).
+    - Одночасні звернення під час оновлення чекають один і той самий запит до Jira (singleflight),
+      тож навантаження на Jira не залежить від кількості натискань.
+    - Оновлення інкрементальне: лише завдання, змінені з моменту попередньої синхронізації (updated >= -Nm);
+      повна синхронізація - при старті та раз на full_sync_interval (щоб помітити видалені завдання).
+    - Сторінки переглядача завдань (get_page) запитуються в Jira по одній за курсором (nextPageToken у Cloud,
+      startAt у Server/DC) і кешуються на ttl; одночасні запити тієї самої сторінки теж об'єднуються.
+    """
+
+    def __init__(self, client: AsyncJiraClient, ttl: float = JIRA_CACHE_TTL, max_stale: float = JIRA_CACHE_MAX_STALE,
+                 full_sync_interval: float = JIRA_FULL_SYNC_INTERVAL, shown: int = JIRA_ISSUES_SHOWN):
+        self.client = client
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.full_sync_interval = full_sync_interval
+        self.shown = shown
+        self._issues: Dict[str, IssueSnapshot] = {}
+        self._text: Optional[str] = None
+        # time.monotonic() останньої успішної синхронізації (None - ще не було) та останньої повної
+        self._synced_at: Optional[float] = None
+        self._full_synced_at: Optional[float] = None
+        self._refresh: Optional[asyncio.Task] = None
+        self._pages = TTLCache(ttl=ttl, max_entries=MAX_CACHED_PAGES)
+        self._page_requests: Dict[Tuple[Optional[str], int], asyncio.Task] = {}
+        self.hits = 0
+        self.refreshes = 0
+
+    def invalidate(self) -> None:
+        """Позначає список застарілим (наприклад, після створення завдання): наступне читання оновить його"""
+        if self._synced_at is not None:
+            self._synced_at -= self.ttl
+        self._pages.clear()
+
+    async def get_page(self, token: Optional[str] = None, page_size: int = JIRA_PAGE_SIZE) -> IssuePage:
+        """Сторінка завдань за курсором (None - перша; помилки Jira прокидаються викликачу)"""
+        key = (token, page_size)
+        page = self._pages.get(key)
+        if page is not None:
+            return page
+        request = self._page_requests.get(key)
+        if request is None:
+            request = asyncio.create_task(self.client.fetch_page(token, page_size))
+            self._page_requests[key] = request
+            request.add_done_callback(lambda _: self._page_requests.pop(key, None))
+        page = await asyncio.shield(request)
+        self._pages.set(key, page)
+        return page
+
+    async def get_text(self) -> str:
+        """Markdown-список завдань"""
+        age = time.monotonic() - self._synced_at if self._synced_at is not None else None
+        if age is not None and age < self.ttl:
+            self.hits += 1
+            return self._text
+        if age is not None and age < self.max_stale:
+            self.hits += 1
+            self._start_refresh()
+            return self._text
+
+        try:
+            # shield: скасування одного обробника не перериває спільне оновлення для інших
+            await asyncio.shield(self._start_refresh())
+        except asyncio.TimeoutError:
+            return self._fallback(f"{EMOJIS['error']} Jira не відповіла вчасно. Спробуйте пізніше.")
+        except Exception as e:
+            # JIRAError містить текст відповіді Jira в text
+            return self._fallback(f"{EMOJIS['error']} Помилка при отриманні завдань: {getattr(e, 'text', None) or e}")
+        return self._text
+
+    def _fallback(self, error_text: str) -> str:
+        # Дуже старий список все одно корисніший за помилку
+        return self._text or error_text
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.create_task(self._sync())
+            self._refresh.add_done_callback(self._log_refresh_error)
+        return self._refresh
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning(f"[JIRA_CACHE] Не вдалося оновити список завдань: {task.exception()!r}")
+
+    async def _sync(self) -> None:
+        started = time.monotonic()
+        full = self._full_synced_at is None or started - self._full_synced_at >= self.full_sync_interval
+        if full:
+            issues = await self.client.fetch_issues()
+            self._issues = {issue.key: issue for issue in issues}
+            self._full_synced_at = started
+        else:
+            minutes = math.ceil((started - self._synced_at) / 60) + DELTA_OVERLAP_MINUTES
+            changed = await self.client.fetch_issues(updated_within_minutes=minutes)
+            for issue in changed:
+                if issue.status.lower() == SHOWN_STATUS:
+                    self._issues[issue.key] = issue
+                else:
+                    self._issues.pop(issue.key, None)
+            # Дельта впирається в ліміт - частину змін могли не побачити
+            if len(changed) >= JIRA_SYNC_LIMIT:
+                self._full_synced_at = None
+
+        shown = sorted(self._issues.values(), key=lambda issue: issue.updated, reverse=True)[:self.shown]
+        self._text = self.client.format_issues(shown)
+        self._synced_at = started
+        self.refreshes += 1
+        logging.warning(
+            f"[JIRA_CACHE] {'Повна синхронізація' if full else 'Дельта'}: {len(self._issues)} завдань у кеші, "
+            f"{(time.monotonic() - started) * 1000:.0f} мс (звернень з кешу: {self.hits}, оновлень: {self.refreshes})"
+        )
+
+
+# Глобальний кеш списку завдань
+issue_cache = IssueCache(async_jira_client)
@@ -1,59 +1,219 @@
 import os
-from jira import JIRA, JIRAError
-from config import EMOJIS
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    EMOJIS, JIRA_CACHE_TTL, JIRA_ISSUES_SHOWN, JIRA_MAX_WORKERS, JIRA_RECONNECT_INTERVAL, JIRA_SYNC_LIMIT,
+    JIRA_TIMEOUT
+)
+
+# Поля, які потрібні для списку завдань (решта полів і expand не запитуються)
+ISSUE_FIELDS = 'summary,status,priority,updated'
+
+class IssueSnapshot:
+    """Поля завдання, потрібні для списку (без повного об'єкта Issue)"""
+
+    __slots__ = ('key', 'summary', 'status', 'priority', 'updated')
+
+    def __init__(self, key, summary, status, priority, updated):
+        self.key = key
+        self.summary = summary
+        self.status = status
+        self.priority = priority
+        # Unix-час останньої зміни
+        self.updated = updated
+
+    @classmethod
+    def from_issue(cls, issue):
+        fields = issue.fields
+        priority = fields.priority.name if getattr(fields, 'priority', None) else 'Не вказано'
+        try:
+            updated = datetime.strptime(fields.updated, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()
+        except (AttributeError, TypeError, ValueError):
+            updated = 0.0
+        return cls(issue.key, fields.summary, fields.status.name, priority, updated)
+
+
+class IssuePage:
+    """
+    Сторінка списку завдань: знімки, загальна кількість та курсор наступної сторінки.
+    Курсор - непрозорий рядок: nextPageToken у Jira Cloud, startAt наступної сторінки в Server/DC
+    (None - сторінка остання). У Cloud загальна кількість приблизна (approximate-count).
+    """
+
+    __slots__ = ('issues', 'page_size', 'total', 'next_token', 'approximate')
+
+    def __init__(self, issues, page_size, total, next_token, approximate=False):
+        self.issues = issues
+        self.page_size = page_size
+        self.total = total
+        self.next_token = next_token
+        self.approximate = approximate
+
+    @property
+    def has_next(self):
+        return self.next_token is not None
+
+    @property
+    def count(self):
+        return max(1, -(-self.total // self.page_size))
+
 
 class JiraClient:
+    """
+    Синхронний клієнт Jira. Бібліотека jira імпортується, а логін виконується лише при першому зверненні
+    до client (у потоці AsyncJiraClient), тож імпорт модуля не робить мережевих запитів і не гальмує старт бота.
+    """
+
     def __init__(self):
         self.server = os.getenv('JIRA_SERVER')
         self.email = os.getenv('JIRA_EMAIL')
         self.api_token = os.getenv('JIRA_API_TOKEN')
         self.project_key = os.getenv('JIRA_PROJECT_KEY')
-        self.client = None
-        self._connect()
+        self._client = None
+        # time.monotonic() останньої невдалої спроби підключення
+        self._failed_at = None
+        self._connect_lock = threading.Lock()
+        # (time.monotonic(), jql, кількість) останнього approximate-count у Jira Cloud
+        self._approximate_count = None
+
+    @property
+    def client(self):
+        """Підключений клієнт jira або None (після невдачі повторна спроба - не частіше за JIRA_RECONNECT_INTERVAL)"""
+        if self._client is None and (self._failed_at is None
+                                     or time.monotonic() - self._failed_at >= JIRA_RECONNECT_INTERVAL):
+            with self._connect_lock:
+                if self._client is None:
+                    self._connect()
+        return self._client
 
     def _connect(self):
         """Встановлює з'єднання з Jira"""
+        if not self.server:
+            # Без JIRA_SERVER бібліотека стукає на localhost:2990 з довгими повторами
+            print("Jira не налаштовано: JIRA_SERVER порожній")
+            self._failed_at = time.monotonic()
+            return
+
+        from jira import JIRA
+
         try:
-            self.client = JIRA(
+            self._client = JIRA(
                 server=self.server,
-                basic_auth=(self.email, self.api_token)
+                basic_auth=(self.email, self.api_token),
+                timeout=JIRA_TIMEOUT,
+                # Вбудовані повтори бібліотеки чекають десятки секунд - дедлайн виклику важливіший
+                max_retries=1
             )
-        except JIRAError as e:
+            self._failed_at = None
+        except Exception as e:
             print(f"Помилка підключення до Jira: {e}")
-            self.client = None
+            self._client = None
+            self._failed_at = time.monotonic()
 
     def is_connected(self):
-        """Перевіряє, чи встановлено з'єднання з Jira"""
+        """Перевіряє, чи встановлено з'єднання з Jira (за потреби підключається)"""
         return self.client is not None
 
+    def _issues_jql(self, updated_within_minutes=None):
+        if updated_within_minutes is None:
+            return f'project = {self.project_key} AND status = "TO DO" ORDER BY updated DESC'
+        # Дельта: усі змінені завдання незалежно від статусу (щоб помітити ті, що вийшли з TO DO).
+        # Відносний час не залежить від часового поясу користувача Jira
+        return f'project = {self.project_key} AND updated >= "-{updated_within_minutes}m" ORDER BY updated DESC'
+
+    def fetch_issues(self, updated_within_minutes=None, max_results=JIRA_SYNC_LIMIT):
+        """
+        Знімки завдань проекту: усі в статусі TO DO або (з updated_within_minutes) - змінені за останні N хвилин.
+        Запитуються лише поля, потрібні для списку. Помилки Jira прокидаються як JIRAError.
+        """
+        issues = self._search(self._issues_jql(updated_within_minutes), 0, max_results)
+        return [IssueSnapshot.from_issue(issue) for issue in issues]
+
+    def fetch_page(self, token, page_size):
+        """
+        Одна сторінка завдань у статусі TO DO за курсором (None - перша сторінка).
+        Jira Cloud (jira 3.10) гортає /search/jql лише за nextPageToken: startAt > 0 там дає JIRAError,
+        а total у відповіді - це лише довжина сторінки, тому кількість береться з approximate-count.
+        Server/DC гортає за startAt і повертає точний total.
+        """
+        client = self._require_client()
+        jql = self._issues_jql()
+        # deploymentType заповнюється з serverInfo при підключенні
+        if getattr(client, 'deploymentType', None) == 'Cloud':
+            issues = client.enhanced_search_issues(
+                jql, nextPageToken=token, maxResults=page_size, fields=ISSUE_FIELDS, expand=None
+            )
+            return IssuePage([IssueSnapshot.from_issue(issue) for issue in issues], page_size,
+                             self._count(client, jql, refresh=token is None), issues.nextPageToken, approximate=True)
+
+        start_at = int(token or 0)
+        issues = self._search(jql, start_at, page_size)
+        next_start = start_at + len(issues)
+        return IssuePage([IssueSnapshot.from_issue(issue) for issue in issues], page_size, issues.total,
+                         str(next_start) if issues and next_start < issues.total else None)
+
+    def _count(self, client, jql, refresh):
+        """
+        Приблизна кількість завдань (Cloud): запитується на першій сторінці, а під час гортання
+        береться з попереднього запиту, поки він молодший за JIRA_CACHE_TTL
+        """
+        cached = self._approximate_count
+        if not refresh and cached is not None and cached[1] == jql and time.monotonic() - cached[0] < JIRA_CACHE_TTL:
+            return cached[2]
+        count = client.approximate_issue_count(jql)
+        self._approximate_count = (time.monotonic(), jql, count)
+        return count
+
+    def _require_client(self):
+        client = self.client
+        if client is None:
+            raise ConnectionError("Не вдалося підключитися до Jira")
+        return client
+
+    def _search(self, jql, start_at, max_results):
+        return self._require_client().search_issues(
+            jql,
+            startAt=start_at,
+            maxResults=max_results,
+            fields=ISSUE_FIELDS,
+            expand=None,
+            validate_query=False
+        )
+
+    def format_issues(self, issues, title='Ваші завдання'):
+        """Markdown-список завдань для відповіді"""
+        if not issues:
+            return "\u274C Немає завдань у вашому проекті Jira."
+
+        response = [f"{EMOJIS['task']} *{title}:*\n"]
+        for issue in issues:
+            response.append(
+                f"*{issue.key}* - {issue.summary}\n"
+                f"Статус: *{issue.status}* | Пріоритет: *{issue.priority}*\n"
+                f"[Відкрити в Jira]({self.server}/browse/{issue.key})\n"
+            )
+
+        return '\n'.join(response)
+
+    def format_page(self, page, number):
+        """Markdown сторінки завдань з номером сторінки (number рахує викликач: курсори Cloud не мають позиції)"""
+        total = f"~{page.total}" if page.approximate else page.total
+        return self.format_issues(
+            page.issues, title=f"Ваші завдання ({number}/{max(page.count, number)}, всього {total})"
+        )
+
     def get_my_issues(self):
         """Отримує завдання проекту"""
         if not self.is_connected():
             return f"{EMOJIS['error']} Не вдалося підключитися до Jira"
+        from jira import JIRAError
 
         try:
-            issues = self.client.search_issues(
-                f'project = {self.project_key} AND status = "TO DO" ORDER BY updated DESC',
-                maxResults=10
-            )
-            
-            if not issues:
-                return "\u274C Немає завдань у вашому проекті Jira."
-
-            response = [f"{EMOJIS['task']} *Завдання проекту:*\n"]
-            response = [f"{EMOJIS['task']} *Ваші завдання:*\n"]
-            for issue in issues:
-                status = issue.fields.status.name
-                priority = issue.fields.priority.name if hasattr(issue.fields, 'priority') and issue.fields.priority else 'Не вказано'
-                
-                response.append(
-                    f"*{issue.key}* - {issue.fields.summary}\n"
-                    f"Статус: *{status}* | Пріоритет: *{priority}*\n"
-                    f"[Відкрити в Jira]({self.server}/browse/{issue.key})\n"
-                )
-
-            return '\n'.join(response)
-
+            return self.format_issues(self.fetch_issues(max_results=JIRA_ISSUES_SHOWN))
         except JIRAError as e:
             return f"{EMOJIS['error']} Помилка при отриманні завдань: {e.text}"
 
@@ -61,6 +221,7 @@ class JiraClient:
         """Створює нове завдання"""
         if not self.is_connected():
             return f"{EMOJIS['error']} Не вдалося підключитися до Jira"
+        from jira import JIRAError
 
         try:
             issue_dict = {
@@ -80,5 +241,75 @@ class JiraClient:
         except JIRAError as e:
             return f"{EMOJIS['error']} Помилка при створенні завдання: {e.text}"
 
+
+class AsyncJiraClient:
+    """
+    Асинхронний фасад над JiraClient для обробників: синхронні виклики бібліотеки jira виконуються
+    в окремому обмеженому пулі потоків (не в спільному executor event loop) з дедлайном на кожен виклик.
+    Повільна Jira блокує лише свої потоки, а не обробку повідомлень в інших чатах.
+    """
+
+    def __init__(self, client: JiraClient, max_workers: int = JIRA_MAX_WORKERS, timeout: float = JIRA_TIMEOUT):
+        self.client = client
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='jira')
+
+    async def ensure_connected(self) -> bool:
+        """Підключення до Jira в пулі Jira (перше звернення - логін); False, якщо Jira недоступна"""
+        return bool(await self._call('connect', self.client.is_connected))
+
+    async def _call(self, name: str, func, *args):
+        """Виконує func у пулі Jira; після дедлайну повертає None (сам потік дозавершиться з таймаутом HTTP)"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, func, *args), self.timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"[JIRA] {name}: немає відповіді за {self.timeout:.0f} с")
+            return None
+
+    async def get_my_issues(self):
+        """Завдання проекту (текст для відповіді)"""
+        result = await self._call('get_my_issues', self.client.get_my_issues)
+        if result is None:
+            return f"{EMOJIS['error']} Jira не відповіла вчасно. Спробуйте пізніше."
+        return result
+
+    async def fetch_issues(self, updated_within_minutes=None):
+        """Знімки завдань (див. JiraClient.fetch_issues); після дедлайну - asyncio.TimeoutError"""
+        result = await self._call('fetch_issues', self.client.fetch_issues, updated_within_minutes)
+        if result is None:
+            raise asyncio.TimeoutError(f"Jira не відповіла за {self.timeout:.0f} с")
+        return result
+
+    async def fetch_page(self, token, page_size):
+        """Сторінка завдань (див. JiraClient.fetch_page); після дедлайну - asyncio.TimeoutError"""
+        result = await self._call('fetch_page', self.client.fetch_page, token, page_size)
+        if result is None:
+            raise asyncio.TimeoutError(f"Jira не відповіла за {self.timeout:.0f} с")
+        return result
+
+    def format_issues(self, issues):
+        return self.client.format_issues(issues)
+
+    def format_page(self, page, number):
+        return self.client.format_page(page, number)
+
+    async def create_issue(self, summary, description, issue_type='Task'):
+        """Створює нове завдання (текст для відповіді)"""
+        result = await self._call('create_issue', self.client.create_issue, summary, description, issue_type)
+        if result is None:
+            return (
+                f"{EMOJIS['error']} Jira не відповіла вчасно. "
+                "Перевірте в Jira, чи завдання створено, перш ніж повторювати."
+            )
+        return result
+
+    def shutdown(self):
+        """Зупинка: невиконані виклики скасовуються, потоки не чекаємо"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
 # Глобальний екземпляр клієнта Jira
 jira_client = JiraClient()
+# Асинхронний фасад для обробників
+async_jira_client = AsyncJiraClient(jira_client)
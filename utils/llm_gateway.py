@@ -0,0 +1,228 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import AsyncIterator, Dict, Optional
+
+from config import (
+    LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, LLM_MAX_CONCURRENCY, LLM_MAX_RETRIES, LLM_POOL_CONNECTIONS, LLM_TIMEOUT,
+    OPENAI_API_KEY
+)
+
+# Статуси, після яких запит має сенс повторити
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class ModelStats:
+    """Лічильники викликів однієї моделі"""
+    __slots__ = ('calls', 'errors', 'retries', 'latency_total', 'latency_max', 'prompt_tokens', 'completion_tokens')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def observe(self, latency: float, usage=None) -> None:
+        self.calls += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_tokens or 0
+            # У відповіді embeddings немає completion_tokens
+            self.completion_tokens += getattr(usage, 'completion_tokens', 0) or 0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'latency_avg': self.latency_total / self.calls if self.calls else 0.0,
+            'latency_max': self.latency_max,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+        }
+
+
+class LLMGateway:
+    """
+    Єдина точка звернення до OpenAI: один клієнт з одним пулом HTTP-з'єднань,
+    дедлайн на кожен виклик, глобальний семафор запитів у польоті,
+    повтори тимчасових помилок (429/5xx/таймаути) з експоненційною затримкою та jitter,
+    лічильники затримки та токенів по моделях.
+    """
+
+    def __init__(self, api_key: Optional[str] = OPENAI_API_KEY,
+                 timeout: float = LLM_TIMEOUT,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_retries: int = LLM_MAX_RETRIES,
+                 pool_connections: int = LLM_POOL_CONNECTIONS):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_connections = pool_connections
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._stats: Dict[str, ModelStats] = {}
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """
+        Клієнт AsyncOpenAI. SDK openai імпортується важко, тому клієнт створюється при першому зверненні
+        (або заздалегідь у фоні через warm_up), а не при імпорті модуля
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    def _create_client(self):
+        import httpx
+        from openai import AsyncOpenAI
+
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.pool_connections,
+                max_keepalive_connections=self.pool_connections,
+                keepalive_expiry=60,
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=10.0),
+        )
+        # Повтори робимо самі (з урахуванням дедлайну та семафора), тому вбудовані в SDK вимкнені
+        return AsyncOpenAI(api_key=self.api_key, http_client=http_client, max_retries=0)
+
+    def warm_up(self) -> None:
+        """Імпорт SDK та створення клієнта заздалегідь (викликається в потоці після старту бота)"""
+        self.client
+
+    def _model_stats(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats()
+        return stats
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Лічильники по моделях для логування"""
+        return {model: stats.as_dict() for model, stats in self._stats.items()}
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        from openai import (
+            APIConnectionError, APIStatusError, APITimeoutError, InternalServerError, RateLimitError
+        )
+
+        if isinstance(error, (asyncio.TimeoutError, APITimeoutError, APIConnectionError,
+                              RateLimitError, InternalServerError)):
+            return True
+        return isinstance(error, APIStatusError) and error.status_code in RETRYABLE_STATUSES
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """Затримка перед повтором: Retry-After від сервера або експоненційна з повним jitter"""
+        response = getattr(error, 'response', None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get('retry-after', ''))
+                return min(retry_after, LLM_BACKOFF_MAX)
+            except ValueError:
+                pass
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+    async def _retry_or_raise(self, model: str, attempt: int, error: Exception) -> None:
+        stats = self._model_stats(model)
+        if attempt >= self.max_retries or not self._is_retryable(error):
+            stats.errors += 1
+            raise error
+        stats.retries += 1
+        delay = self._backoff(attempt, error)
+        logging.warning(f"[LLM_GATEWAY] {model}: {type(error).__name__}, повтор {attempt + 1} через {delay:.2f} с")
+        await asyncio.sleep(delay)
+
+    async def complete(self, timeout: Optional[float] = None, **kwargs):
+        """chat.completions.create з дедлайном, обмеженням паралельності та повторами"""
+        model = kwargs.get('model', '')
+        deadline = timeout or self.timeout
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    started = time.monotonic()
+                    response = await asyncio.wait_for(self.client.chat.completions.create(**kwargs), deadline)
+                self._model_stats(model).observe(time.monotonic() - started, response.usage)
+                return response
+            except Exception as e:
+                await self._retry_or_raise(model, attempt, e)
+                attempt += 1
+
+    async def embed(self, timeout: Optional[float] = None, **kwargs):
+        """embeddings.create з тими самими дедлайном, семафором та повторами"""
+        model = kwargs.get('model', '')
+        deadline = timeout or self.timeout
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    started = time.monotonic()
+                    response = await asyncio.wait_for(self.client.embeddings.create(**kwargs), deadline)
+                self._model_stats(model).observe(time.monotonic() - started, response.usage)
+                return response
+            except Exception as e:
+                await self._retry_or_raise(model, attempt, e)
+                attempt += 1
+
+    async def stream(self, timeout: Optional[float] = None, **kwargs) -> AsyncIterator[str]:
+        """
+        Потокова відповідь: текстові фрагменти по мірі надходження.
+        Дедлайн діє на очікування кожного наступного фрагмента; повтор можливий лише до першого фрагмента,
+        щоб користувач не отримав дубльований текст.
+        """
+        model = kwargs.get('model', '')
+        deadline = timeout or self.timeout
+        attempt = 0
+        while True:
+            yielded = False
+            try:
+                async with self._semaphore:
+                    started = time.monotonic()
+                    stream = await asyncio.wait_for(
+                        self.client.chat.completions.create(
+                            stream=True, stream_options={"include_usage": True}, **kwargs
+                        ),
+                        deadline,
+                    )
+                    usage = None
+                    chunks = stream.__aiter__()
+                    try:
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(), deadline)
+                            except StopAsyncIteration:
+                                break
+                            if chunk.usage is not None:
+                                usage = chunk.usage
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta.content
+                            if delta:
+                                yielded = True
+                                yield delta
+                    finally:
+                        # Повертаємо з'єднання в пул, навіть якщо споживач зупинився раніше
+                        await stream.close()
+                self._model_stats(model).observe(time.monotonic() - started, usage)
+                return
+            except Exception as e:
+                if yielded:
+                    self._model_stats(model).errors += 1
+                    raise
+                await self._retry_or_raise(model, attempt, e)
+                attempt += 1
+
+
+# Глобальний шлюз до LLM
+llm_gateway = LLMGateway()
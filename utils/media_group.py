@@ -0,0 +1,125 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from config import MEDIA_GROUP_MAX_WINDOW, MEDIA_GROUP_MIN_WINDOW, MEDIA_GROUP_TTL
+
+# Вікно тиші = оцінка інтервалу між фото альбому * коефіцієнт (в межах MIN/MAX)
+GAP_FACTOR = 3.0
+# Вага нового спостереження в експоненційному згладжуванні інтервалу
+GAP_SMOOTHING = 0.2
+# Для скількох чатів пам'ятати оцінку інтервалу (найдавніше активні забуваються)
+MAX_TRACKED_CHATS = 1000
+
+
+class MediaGroupAggregator:
+    """
+    Агрегатор медіа-груп (альбомів) з одним таймером на media_group_id.
+    Кожне нове фото переносить таймер групи (loop.call_later); коли протягом вікна тиші нових фото немає,
+    група передається в on_complete. Вікно тиші підлаштовується під інтервали між фото, спостережені
+    в цьому чаті; доки їх немає, використовується максимальне вікно.
+    Фото, що запізнилися після завершення групи (протягом ttl), відкривають її продовження: create отримує
+    завершену групу, щоб перенести з неї підпис і згадку бота.
+    Групи, старші за ttl, примусово завершуються, а ті, що так і не були оброблені, віддаються в on_discard.
+    """
+
+    def __init__(self, on_complete: Callable[[str, Dict], Awaitable[None]],
+                 on_discard: Callable[[str, Dict], None],
+                 min_window: float = MEDIA_GROUP_MIN_WINDOW,
+                 max_window: float = MEDIA_GROUP_MAX_WINDOW,
+                 ttl: float = MEDIA_GROUP_TTL):
+        self.on_complete = on_complete
+        self.on_discard = on_discard
+        self.min_window = min_window
+        self.max_window = max_window
+        self.ttl = ttl
+        self._groups: Dict[str, Dict] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks = set()
+        # chat_id -> згладжений інтервал між фото альбому
+        self._gap_estimates: "OrderedDict[int, float]" = OrderedDict()
+        # media_group_id -> (час завершення, група) для нещодавно завершених груп
+        self._fired: Dict[str, Tuple[float, Dict]] = {}
+
+    def __contains__(self, media_group_id: str) -> bool:
+        return media_group_id in self._groups
+
+    def quiet_window(self, chat_id: int) -> float:
+        """Поточне вікно тиші для чату, секунди"""
+        gap = self._gap_estimates.get(chat_id)
+        if gap is None:
+            return self.max_window
+        return min(self.max_window, max(self.min_window, gap * GAP_FACTOR))
+
+    def _observe_gap(self, chat_id: int, gap: float) -> None:
+        estimate = self._gap_estimates.pop(chat_id, None)
+        self._gap_estimates[chat_id] = gap if estimate is None else estimate + GAP_SMOOTHING * (gap - estimate)
+        while len(self._gap_estimates) > MAX_TRACKED_CHATS:
+            self._gap_estimates.popitem(last=False)
+
+    def add(self, media_group_id: str, chat_id: int, create: Callable[[Optional[Dict]], Dict]) -> Dict:
+        """
+        Реєструє нове фото групи: створює групу через create(завершена_група або None), якщо її ще немає,
+        оновлює оцінку інтервалу чату та переносить таймер. Повертає дані групи для доповнення.
+        """
+        now = time.monotonic()
+        self._sweep(now)
+
+        group = self._groups.get(media_group_id)
+        if group is None:
+            fired = self._fired.get(media_group_id)
+            previous = fired[1] if fired is not None else None
+            if previous is not None:
+                logging.warning(f"[MEDIA_GROUP] Фото групи {media_group_id} запізнилося, відкриваємо продовження")
+                self._observe_gap(chat_id, now - previous['last_update'])
+            group = create(previous)
+            group['created_at'] = now
+            self._groups[media_group_id] = group
+        else:
+            self._observe_gap(chat_id, now - group['last_update'])
+        group['last_update'] = now
+
+        timer = self._timers.pop(media_group_id, None)
+        if timer is not None:
+            timer.cancel()
+
+        # Група, що збирається довше ttl, завершується без очікування
+        group['window'] = 0 if now - group['created_at'] >= self.ttl else self.quiet_window(chat_id)
+        self._timers[media_group_id] = asyncio.get_running_loop().call_later(
+            group['window'], self._fire, media_group_id
+        )
+        return group
+
+    def _fire(self, media_group_id: str) -> None:
+        self._timers.pop(media_group_id, None)
+        now = time.monotonic()
+        self._sweep(now)
+        group = self._groups.pop(media_group_id, None)
+        if group is None:
+            return
+        self._fired[media_group_id] = (now, group)
+        logging.warning(
+            f"[MEDIA_GROUP] Група {media_group_id} завершена, вікно тиші {group['window']:.2f} с"
+        )
+        task = asyncio.create_task(self.on_complete(media_group_id, group))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _sweep(self, now: float) -> None:
+        """Жорстке прибирання покинутих груп, які давно пережили ttl (наприклад, таймер загублено)"""
+        expired = [
+            media_group_id for media_group_id, group in self._groups.items()
+            if now - group['created_at'] > self.ttl * 2
+        ]
+        for media_group_id in expired:
+            group = self._groups.pop(media_group_id)
+            timer = self._timers.pop(media_group_id, None)
+            if timer is not None:
+                timer.cancel()
+            logging.warning(f"[MEDIA_GROUP] Група {media_group_id} покинута, прибираємо")
+            self.on_discard(media_group_id, group)
+
+        for media_group_id in [key for key, (fired_at, _) in self._fired.items() if now - fired_at > self.ttl]:
+            del self._fired[media_group_id]
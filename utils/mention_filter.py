@@ -0,0 +1,44 @@
+import re
+from typing import Optional
+
+from telegram import Message
+from telegram.ext.filters import MessageFilter
+
+
+class BotMentionFilter(MessageFilter):
+    """
+    PTB-фільтр, який пропускає лише повідомлення зі згадкою бота (@username) у тексті або підписі.
+    Ім'я бота задається один раз при старті (set_username), регулярний вираз компілюється один раз,
+    тому повідомлення без згадки відсікаються ще до запуску корутини хендлера.
+    """
+
+    __slots__ = ('username', '_pattern')
+
+    def __init__(self) -> None:
+        super().__init__(name='filters.BotMention')
+        self.username: Optional[str] = None
+        self._pattern: Optional[re.Pattern] = None
+
+    def set_username(self, username: str) -> None:
+        """Запам'ятовує ім'я бота та компілює регулярний вираз для згадки"""
+        self.username = username
+        self._pattern = re.compile(rf"@{re.escape(username)}\b", re.IGNORECASE)
+
+    def matches(self, text: Optional[str]) -> bool:
+        """Перевіряє чи містить текст згадку бота"""
+        if not text or self._pattern is None:
+            return False
+        return self._pattern.search(text) is not None
+
+    def strip_mention(self, text: str) -> str:
+        """Повертає текст без згадки бота"""
+        if not text or self._pattern is None:
+            return text or ""
+        return self._pattern.sub("", text).strip()
+
+    def filter(self, message: Message) -> bool:
+        return self.matches(message.text or message.caption)
+
+
+# Глобальний екземпляр фільтра (ім'я бота встановлюється в post_init)
+bot_mention = BotMentionFilter()
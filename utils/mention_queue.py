@@ -0,0 +1,53 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Coroutine, Dict, List, Optional
+
+from config import MENTION_COALESCE_MAX_BATCH
+
+
+class ChatRequestQueue:
+    """
+    Черга звернень до бота з об'єднанням по чатах.
+    Звернення в чаті, де зараз нічого не обробляється, передається в process одразу, без очікування.
+    У кожному чаті одночасно обробляється не більше одного пакета: звернення, що надійшли під час обробки,
+    накопичуються і після неї передаються в process одним пакетом (до max_batch звернень).
+    Пакет запускається через create_task(корутина, останнє звернення пакета) - наприклад, Application.create_task
+    з update звернення, щоб помилки потрапляли в error handler, а задачі дочікувалися при зупинці.
+    """
+
+    def __init__(self, process: Callable[[int, List[Any]], Awaitable[None]],
+                 max_batch: int = MENTION_COALESCE_MAX_BATCH,
+                 create_task: Optional[Callable[[Coroutine, Any], asyncio.Task]] = None):
+        self.process = process
+        self.max_batch = max_batch
+        self.create_task = create_task or (lambda coro, item: asyncio.create_task(coro))
+        self._pending: Dict[int, List[Any]] = {}
+        self._inflight: Dict[int, asyncio.Task] = {}
+
+    def submit(self, chat_id: int, item: Any) -> None:
+        """Додає звернення в чергу чату"""
+        self._pending.setdefault(chat_id, []).append(item)
+
+        # Поки в чаті йде обробка, звернення накопичуються і відправляються після неї
+        if chat_id not in self._inflight:
+            self._flush(chat_id)
+
+    def _flush(self, chat_id: int) -> None:
+        pending = self._pending.pop(chat_id, None)
+        if not pending:
+            return
+
+        batch, rest = pending[:self.max_batch], pending[self.max_batch:]
+        if rest:
+            self._pending[chat_id] = rest
+        if len(batch) > 1:
+            logging.warning(f"[MENTION_QUEUE] Чат {chat_id}: одна відповідь на звернень: {len(batch)}")
+        self._inflight[chat_id] = self.create_task(self._run(chat_id, batch), batch[-1])
+
+    async def _run(self, chat_id: int, batch: List[Any]) -> None:
+        # Помилки обробки не перехоплюються: їх отримує той, хто запустив задачу (error handler)
+        try:
+            await self.process(chat_id, batch)
+        finally:
+            self._inflight.pop(chat_id, None)
+            self._flush(chat_id)
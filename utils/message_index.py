@@ -0,0 +1,254 @@
+import os
+import re
+import time
+import sqlite3
+import asyncio
+import logging
+from typing import List, Optional, Sequence, Tuple
+
+from config import BASE_DIR, DATABASE, SEARCH_INDEX_BATCH_SIZE, SEARCH_INDEX_FLUSH_INTERVAL
+
+# chat - індексований токен чату (chat_token), щоб фільтр по чату виконувався в самому MATCH,
+# а не після глобального пошуку по всіх чатах
+_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text,
+    chat,
+    username UNINDEXED,
+    chat_id UNINDEXED,
+    message_id UNINDEXED,
+    timestamp UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+# Слова запиту: літери/цифри (з апострофом всередині), не коротші за MIN_TERM_LENGTH символів
+MIN_TERM_LENGTH = 4
+_TERM_RE = re.compile(r"\w[\w'’]{%d,}" % (MIN_TERM_LENGTH - 1))
+# Поширені слова, що є майже в кожному повідомленні: префіксний пошук за ними лише розмиває ранжування
+# (включно зі словами-маркерами звернення до історії - вони є в питанні, а не в шуканих повідомленнях)
+QUERY_STOP_WORDS = frozenset({
+    'якщо', 'щодо', 'коли', 'чому', 'тому', 'також', 'тільки', 'лише', 'може', 'можна', 'треба', 'дуже',
+    'просто', 'буде', 'було', 'була', 'були', 'вона', 'вони', 'воно', 'мене', 'тебе', 'цього', 'цьому',
+    'щоби', 'скажи', 'розкажи', 'будь', 'ласка', 'знаєш', 'пам\'ятаєш', 'нагадай', 'раніше', 'вчора',
+    'позавчора', 'казав', 'казала', 'казали', 'писав', 'писала', 'писали', 'знайди', 'шукай',
+    'this', 'that', 'with', 'from', 'have', 'what', 'when', 'where', 'which', 'there', 'they', 'them',
+    'about', 'would', 'could', 'should', 'your', 'just', 'remember', 'earlier', 'yesterday',
+})
+# Максимальна кількість термів у запиті до індексу
+MAX_QUERY_TERMS = 8
+# Скільки неіндексованих повідомлень тримати в черзі, якщо запис у базу не вдається (найстаріші відкидаються)
+MAX_PENDING_ROWS = 10000
+# Маркери збігів у snippet (керуючі символи, щоб не конфліктувати з текстом повідомлень)
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+# Питання, що посилаються на давніше обговорення
+_REFERENCE_RE = re.compile(
+    r"пам'?ят|пам’ят|раніше|вчора|позавчора|минул|тоді|згадува|обговорюва|казав|казала|казали|писав|писала|писали|"
+    r"вирішил|домовил|нагада|шукай|знайди|earlier|remember|yesterday|last week",
+    re.IGNORECASE
+)
+
+
+class SearchResult:
+    """
+    Знайдене повідомлення з історії.
+    rank - bm25 для повнотекстового пошуку (менше - краще) або косинусна схожість для семантичного (більше - краще)
+    """
+
+    __slots__ = ('chat_id', 'message_id', 'username', 'text', 'timestamp', 'snippet', 'rank')
+
+    def __init__(self, chat_id: int, message_id: Optional[int], username: str, text: str,
+                 timestamp: Optional[float], snippet: str, rank: float):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.username = username
+        self.text = text
+        self.timestamp = timestamp
+        self.snippet = snippet
+        self.rank = rank
+
+    def render(self) -> str:
+        """Рядок для промпта '[дата] [username]: text'"""
+        when = time.strftime('%d.%m.%Y %H:%M', time.localtime(self.timestamp)) if self.timestamp else '?'
+        return f"[{when}] [{self.username}]: {self.text}\n"
+
+
+def refers_to_past(question: str) -> bool:
+    """Чи посилається питання на давніше обговорення"""
+    return bool(_REFERENCE_RE.search(question))
+
+
+def chat_token(chat_id: int) -> str:
+    """Токен чату для колонки chat: 'c123' / 'cm100123' (мінус - роздільник для токенізатора)"""
+    return 'c' + str(chat_id).replace('-', 'm')
+
+
+def build_match_query(text: str) -> Optional[str]:
+    """
+    FTS5-запит з довільного тексту (лише по колонці text): терми в лапках (без синтаксису FTS від користувача),
+    з префіксним пошуком для відмінків, об'єднані через OR (ранжування робить bm25).
+    Службові та короткі слова відкидаються
+    """
+    terms = [term.lower().replace('’', "'") for term in _TERM_RE.findall(text)]
+    terms = list(dict.fromkeys(term for term in terms if term not in QUERY_STOP_WORDS))
+    if not terms:
+        return None
+    # Довші слова інформативніші
+    terms = sorted(terms, key=len, reverse=True)[:MAX_QUERY_TERMS]
+    return 'text : (' + ' OR '.join(f'"{term[:max(3, len(term) - 2)]}"*' for term in terms) + ')'
+
+
+class MessageIndex:
+    """
+    Повнотекстовий індекс повідомлень чатів (SQLite FTS5 у файлі DATABASE).
+    Повідомлення накопичуються в пам'яті і записуються пакетами у фоновому потоці
+    (кожні flush_interval секунд або при накопиченні batch_size записів).
+    Пошук - локальний запит з ранжуванням bm25, теж поза event loop.
+    """
+
+    def __init__(self, filepath: str = DATABASE, batch_size: int = SEARCH_INDEX_BATCH_SIZE,
+                 flush_interval: float = SEARCH_INDEX_FLUSH_INTERVAL):
+        self.filepath = filepath if os.path.isabs(filepath) else os.path.join(BASE_DIR, filepath)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._pending: List[Tuple] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+            connection = sqlite3.connect(self.filepath, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            self._migrate(connection)
+            self._connection = connection
+        return self._connection
+
+    @staticmethod
+    def _migrate(connection: sqlite3.Connection) -> None:
+        """Індекс старого формату (без колонки chat) перебудовується з уже збережених повідомлень"""
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(messages_fts)")]
+        if 'chat' in columns:
+            return
+        logging.warning("[SEARCH_INDEX] Перебудова індексу: додається колонка chat")
+        with connection:
+            # Явна транзакція: DDL інакше виконується поза нею, і збій посередині залишив би порожній індекс
+            connection.execute("BEGIN")
+            connection.execute("ALTER TABLE messages_fts RENAME TO messages_fts_old")
+            connection.execute(_SCHEMA.strip().rstrip(';'))
+            connection.execute(
+                """
+                INSERT INTO messages_fts (text, chat, username, chat_id, message_id, timestamp)
+                SELECT text, 'c' || replace(CAST(chat_id AS TEXT), '-', 'm'), username, chat_id, message_id, timestamp
+                FROM messages_fts_old
+                """
+            )
+            connection.execute("DROP TABLE messages_fts_old")
+
+    async def _run(self, func, *args):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            return await asyncio.to_thread(func, *args)
+
+    # --- Запис ---
+
+    def add(self, chat_id: int, message_id: Optional[int], username: str, text: str,
+            timestamp: Optional[float]) -> None:
+        """Ставить повідомлення в чергу на індексацію"""
+        if not text or not text.strip():
+            return
+        self._pending.append((text, chat_token(chat_id), username, chat_id, message_id, timestamp))
+        if len(self._pending) >= self.batch_size:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush())
+
+    def _insert(self, rows: Sequence[Tuple]) -> None:
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT INTO messages_fts (text, chat, username, chat_id, message_id, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    async def flush(self) -> None:
+        """Записує накопичені повідомлення однією транзакцією"""
+        while self._pending:
+            rows, self._pending = self._pending, []
+            try:
+                await self._run(self._insert, rows)
+            except Exception as e:
+                logging.error(f"[SEARCH_INDEX] Не вдалося записати {len(rows)} повідомлень: {e}")
+                # Не втрачаємо повідомлення: повертаємо їх у чергу перед новішими
+                self._pending = rows + self._pending
+                if len(self._pending) > MAX_PENDING_ROWS:
+                    dropped = len(self._pending) - MAX_PENDING_ROWS
+                    self._pending = self._pending[dropped:]
+                    logging.error(f"[SEARCH_INDEX] Черга переповнена, відкинуто {dropped} найстаріших повідомлень")
+                return
+            logging.info(f"[SEARCH_INDEX] Проіндексовано {len(rows)} повідомлень")
+
+    async def close(self) -> None:
+        """Викликається при зупинці: дописує чергу і закриває з'єднання"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is not None:
+            await self._flush_task
+        await self.flush()
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+
+    # --- Пошук ---
+
+    def _query(self, chat_id: int, match: str, limit: int, exclude: Tuple[int, ...]) -> List[SearchResult]:
+        rows = self._connect().execute(
+            """
+            SELECT chat_id, message_id, username, text, timestamp,
+                   snippet(messages_fts, 0, ?, ?, '…', 12), bm25(messages_fts)
+            FROM messages_fts
+            WHERE messages_fts MATCH ?
+            ORDER BY bm25(messages_fts)
+            LIMIT ?
+            """,
+            (SNIPPET_START, SNIPPET_END, f'chat : "{chat_token(chat_id)}" AND {match}', limit + len(exclude))
+        ).fetchall()
+        results = [SearchResult(*row) for row in rows if row[1] not in exclude]
+        return results[:limit]
+
+    async def search(self, chat_id: int, text: str, limit: int = 5,
+                     exclude_message_ids: Sequence[int] = ()) -> List[SearchResult]:
+        """Найрелевантніші повідомлення чату для довільного тексту (найкращі першими)"""
+        match = build_match_query(text)
+        if match is None:
+            return []
+        started = time.perf_counter()
+        try:
+            results = await self._run(self._query, chat_id, match, limit, tuple(exclude_message_ids))
+        except Exception as e:
+            logging.error(f"[SEARCH_INDEX] Помилка пошуку '{match}': {e}")
+            return []
+        logging.warning(
+            f"[SEARCH_INDEX] '{match}' у чаті {chat_id}: {len(results)} результатів "
+            f"за {(time.perf_counter() - started) * 1000:.1f} мс"
+        )
+        return results
+
+
+# Глобальний індекс повідомлень
+message_index = MessageIndex()
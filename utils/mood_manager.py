@@ -1,13 +1,34 @@
 import re
+import json
+import time
+import hashlib
 import logging
+from collections import OrderedDict, deque
 from typing import Dict, List, Optional, Tuple
-from openai import AsyncOpenAI
-from config import OPENAI_API_KEY
+from config import AVATAR_CACHE_FILE
 import os
 from pathlib import Path
+from utils.ttl_cache import TTLCache
+from utils.mood_matcher import MoodMatcher
+from utils.llm_gateway import llm_gateway
 
-# OpenAI client for tone analysis
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# Tone analysis memoization: successful results, negative results after failures, global backoff
+TONE_CACHE_TTL = 1800
+TONE_CACHE_MAX_ENTRIES = 1024
+TONE_NEGATIVE_TTL = 120
+TONE_FAILURE_BACKOFF = 60
+
+# Per-chat mood state: bounded LRU with idle eviction
+MOOD_STATE_MAX_CHATS = 1000
+MOOD_STATE_IDLE_TTL = 6 * 3600
+MOOD_HISTORY_SIZE = 5
+
+# Missing avatar images are re-checked on disk at most this often (seconds)
+AVATAR_MISSING_RECHECK = 300
+
+# Structured tone mode: the main completion starts with a tone header line that is parsed and stripped
+TONE_HEADER_RE = re.compile(r"^\s*\[\[tone:\s*(\w+)\s*\]\]\s*", re.IGNORECASE)
+TONE_HEADER_MAX_LENGTH = 32
 
 # Mood configuration
 MOOD_CONFIG = {
@@ -41,39 +62,89 @@ MOOD_CONFIG = {
     }
 }
 
-class MoodManager:
+# Keywords and patterns compiled once into a single-pass matcher
+MOOD_MATCHER = MoodMatcher(MOOD_CONFIG)
+
+class MoodState:
+    """Compact mood record of a single chat"""
+    __slots__ = ('mood', 'history', 'last_used')
+
     def __init__(self):
-        self.current_mood = 'neutral'
-        self.current_avatar = None
-        self.message_history = []
-        self.avatar_cache = {}
+        self.mood = 'neutral'
+        self.history = deque(maxlen=MOOD_HISTORY_SIZE)
+        self.last_used = time.monotonic()
+
+
+class MoodManager:
+    def __init__(self, max_chats: int = MOOD_STATE_MAX_CHATS, idle_ttl: float = MOOD_STATE_IDLE_TTL):
+        # chat_id -> MoodState, least recently used first
+        self._states: "OrderedDict[int, MoodState]" = OrderedDict()
+        self.max_chats = max_chats
+        self.idle_ttl = idle_ttl
+        # Shared across chats: tone memo is keyed by message content, not by chat
+        self.tone_cache = TTLCache(ttl=TONE_CACHE_TTL, max_entries=TONE_CACHE_MAX_ENTRIES)
+        self._ai_unavailable_until = 0.0
+        # Optional persisted chat_id -> mood mapping (lives in bot_data, saved by the persistence)
+        self._mood_store: Optional[Dict[int, str]] = None
+        # Avatar registry: mood -> Telegram file_id of the uploaded avatar, persisted across restarts
+        self.avatar_cache_file = AVATAR_CACHE_FILE
+        self.avatar_cache: Dict[str, Dict] = self._load_avatar_cache()
+        # mood -> monotonic time until which the avatar image is known to be missing
+        self._missing_avatars: Dict[str, float] = {}
+    
+    def bind_store(self, store: Dict[int, str]) -> None:
+        """Keep chat moods in a persisted mapping so they survive restarts"""
+        self._mood_store = store
+    
+    def _get_state(self, chat_id: int) -> MoodState:
+        """Get or create mood state of a chat, evicting idle and least recently used chats"""
+        now = time.monotonic()
+        state = self._states.get(chat_id)
+        if state is None:
+            state = MoodState()
+            if self._mood_store is not None:
+                state.mood = self._mood_store.get(chat_id, state.mood)
+            self._states[chat_id] = state
+        else:
+            self._states.move_to_end(chat_id)
+        state.last_used = now
+        self._evict(now)
+        return state
+    
+    def _evict(self, now: float) -> None:
+        while self._states:
+            chat_id, oldest = next(iter(self._states.items()))
+            if len(self._states) <= self.max_chats and now - oldest.last_used <= self.idle_ttl:
+                break
+            del self._states[chat_id]
+            if self._mood_store is not None:
+                self._mood_store.pop(chat_id, None)
+            logging.info(f"[MOOD_MANAGER] Evicted mood state of chat {chat_id}")
         
     def _analyze_keywords(self, text: str) -> Dict[str, int]:
-        """Analyze text using keyword matching"""
-        text_lower = text.lower()
-        scores = {'happy': 0, 'sad': 0, 'evil': 0, 'neutral': 0}
-        
-        for mood, config in MOOD_CONFIG.items():
-            # Check keywords
-            for keyword in config['keywords']:
-                if keyword in text_lower:
-                    scores[mood] += 1
-                    
-            # Check patterns
-            for pattern in config['patterns']:
-                if re.search(pattern, text, re.IGNORECASE):
-                    scores[mood] += 2
-                    
-        return scores
+        """Analyze text using the precompiled single-pass keyword/pattern matcher"""
+        return MOOD_MATCHER.scores(text)
     
     async def _analyze_tone_with_ai(self, messages: List[str]) -> str:
         """Analyze tone using OpenAI for more sophisticated detection"""
         if not messages:
             return 'neutral'
             
+        # Combine recent messages for context
+        combined_text = ' '.join(messages[-3:])  # Last 3 messages
+        cache_key = hashlib.blake2b(combined_text.encode('utf-8'), digest_size=16).hexdigest()
+        
+        cached_mood = self.tone_cache.get(cache_key)
+        if cached_mood is not None:
+            logging.info(f"[MOOD_MANAGER] Tone cache hit: {cached_mood}")
+            return cached_mood
+        
+        # Negative cache: after a failure skip AI calls for a while instead of timing out on every mention
+        if time.monotonic() < self._ai_unavailable_until:
+            logging.info("[MOOD_MANAGER] AI tone analysis in backoff, using neutral")
+            return 'neutral'
+            
         try:
-            # Combine recent messages for context
-            combined_text = ' '.join(messages[-3:])  # Last 3 messages
             
             system_prompt = """
             Analyze the tone and emotional state of the following messages. 
@@ -85,7 +156,7 @@ class MoodManager:
             - neutral: factual, technical, dry, professional
             """
             
-            response = await client.chat.completions.create(
+            response = await llm_gateway.complete(
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -98,51 +169,70 @@ class MoodManager:
             detected_mood = response.choices[0].message.content.strip().lower()
             
             # Validate response
-            if detected_mood in MOOD_CONFIG:
-                return detected_mood
-            else:
-                return 'neutral'
+            if detected_mood not in MOOD_CONFIG:
+                detected_mood = 'neutral'
+            
+            self.tone_cache.set(cache_key, detected_mood)
+            return detected_mood
                 
         except Exception as e:
             logging.error(f"[MOOD_MANAGER] AI tone analysis failed: {e}")
+            self._ai_unavailable_until = time.monotonic() + TONE_FAILURE_BACKOFF
+            self.tone_cache.set(cache_key, 'neutral', ttl=TONE_NEGATIVE_TTL)
             return 'neutral'
     
-    def detect_mood(self, text: str, use_ai: bool = True) -> str:
-        """Detect mood from text using combined approach"""
+    def keyword_mood(self, chat_id: int, text: str) -> Optional[str]:
+        """Record the message in the chat's history and return the keyword mood, if any matched"""
         if not text:
-            return 'neutral'
-            
-        # Add to message history
-        self.message_history.append(text)
-        self.message_history = self.message_history[-5:]  # Keep last 5 messages
+            return None
+        
+        # Add to the chat's message history
+        self._get_state(chat_id).history.append(text)
         
         # Keyword-based analysis
         keyword_scores = self._analyze_keywords(text)
         
         # Find highest scoring mood
         best_mood = max(keyword_scores, key=keyword_scores.get)
+        return best_mood if keyword_scores[best_mood] > 0 else None
+    
+    def detect_mood(self, chat_id: int, text: str, use_ai: bool = True) -> str:
+        """Detect mood from text using combined approach"""
+        if not text:
+            return 'neutral'
+        
+        keyword_mood = self.keyword_mood(chat_id, text)
         
         # If no clear winner or using AI, fall back to AI analysis
-        if keyword_scores[best_mood] == 0 and use_ai:
+        if keyword_mood is None and use_ai:
             # Return a coroutine that needs to be awaited
-            return self._analyze_tone_with_ai(self.message_history)
+            # Snapshot: concurrent mentions in the same chat keep appending while the AI call is in flight
+            return self._analyze_tone_with_ai(list(self._get_state(chat_id).history))
         
-        return best_mood if keyword_scores[best_mood] > 0 else 'neutral'
+        return keyword_mood or 'neutral'
     
-    async def update_mood(self, text: str, use_ai: bool = True) -> Tuple[str, float, str]:
-        """Update mood and return mood, temperature, and emoji"""
-        detected_mood = self.detect_mood(text, use_ai)
+    async def update_mood(self, chat_id: int, text: str, use_ai: bool = True) -> Tuple[str, float, str]:
+        """Update the chat's mood and return mood, temperature, and emoji"""
+        detected_mood = self.detect_mood(chat_id, text, use_ai)
         
         # If detect_mood returned a coroutine, await it
         if hasattr(detected_mood, '__await__'):
             detected_mood = await detected_mood
-            
-        self.current_mood = detected_mood
-        config = MOOD_CONFIG[detected_mood]
         
-        logging.info(f"[MOOD_MANAGER] Updated mood to: {detected_mood}")
+        return self.set_mood(chat_id, detected_mood)
+    
+    def set_mood(self, chat_id: int, mood: str) -> Tuple[str, float, str]:
+        """Set the chat's mood and return mood, temperature, and emoji"""
+        if mood not in MOOD_CONFIG:
+            mood = 'neutral'
+        self._get_state(chat_id).mood = mood
+        if self._mood_store is not None:
+            self._mood_store[chat_id] = mood
+        config = MOOD_CONFIG[mood]
+        
+        logging.info(f"[MOOD_MANAGER] Updated mood of chat {chat_id} to: {mood}")
         
-        return detected_mood, config['temperature'], config['emoji']
+        return mood, config['temperature'], config['emoji']
     
     def get_status_prefix(self, mood: str, temperature: float) -> str:
         """Generate status prefix for responses"""
@@ -167,27 +257,144 @@ class MoodManager:
         return f"data/bot_status/{MOOD_CONFIG[mood]['avatar']}"
     
     def mood_image_exists(self, mood: str) -> bool:
-        """Check if mood image exists"""
+        """Check if mood image exists (a missing image is logged once and re-checked periodically)"""
+        now = time.monotonic()
+        if self._missing_avatars.get(mood, 0.0) > now:
+            return False
         image_path = self.get_mood_image_path(mood)
         exists = os.path.exists(image_path)
         if not exists:
             logging.error(f"[MOOD_MANAGER] Mood image not found: {image_path}")
+            self._missing_avatars[mood] = now + AVATAR_MISSING_RECHECK
         return exists
     
-    def get_current_mood(self) -> str:
-        """Get current mood"""
-        return self.current_mood
+    def get_avatar_file_id(self, mood: str) -> Optional[str]:
+        """Telegram file_id of the already uploaded avatar for a mood"""
+        entry = self.avatar_cache.get(mood)
+        return entry['file_id'] if entry else None
+    
+    def remember_avatar(self, mood: str, file_id: str) -> None:
+        """Remember the file_id returned by the first upload of a mood avatar"""
+        image_path = self.get_mood_image_path(mood)
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return
+        self.avatar_cache[mood] = {
+            'avatar': MOOD_CONFIG[mood]['avatar'],
+            'file_id': file_id,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+        }
+        self._save_avatar_cache()
+        logging.info(f"[MOOD_MANAGER] Cached avatar file_id for mood: {mood}")
+    
+    def forget_avatar(self, mood: str) -> None:
+        """Drop a file_id Telegram no longer accepts (e.g. after the bot token changed)"""
+        if self.avatar_cache.pop(mood, None) is not None:
+            self._save_avatar_cache()
+            logging.warning(f"[MOOD_MANAGER] Dropped cached avatar file_id for mood: {mood}")
+    
+    def _load_avatar_cache(self) -> Dict[str, Dict]:
+        """Load persisted file_ids, skipping entries whose image file has changed since the upload"""
+        try:
+            with open(self.avatar_cache_file, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.error(f"[MOOD_MANAGER] Failed to load avatar cache: {e}")
+            return {}
+        
+        avatar_cache = {}
+        for mood, entry in stored.items():
+            if mood not in MOOD_CONFIG or entry.get('avatar') != MOOD_CONFIG[mood]['avatar']:
+                continue
+            try:
+                stat = os.stat(self.get_mood_image_path(mood))
+            except OSError:
+                continue
+            if stat.st_size == entry.get('size') and stat.st_mtime == entry.get('mtime'):
+                avatar_cache[mood] = entry
+        return avatar_cache
+    
+    def _save_avatar_cache(self) -> None:
+        tmp_path = f"{self.avatar_cache_file}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.avatar_cache, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.avatar_cache_file)
+        except OSError as e:
+            logging.error(f"[MOOD_MANAGER] Failed to save avatar cache: {e}")
+    
+    def get_current_mood(self, chat_id: int) -> str:
+        """Get current mood of a chat"""
+        state = self._states.get(chat_id)
+        return state.mood if state is not None else 'neutral'
     
-    def get_temperature(self, mood: str = None) -> float:
-        """Get temperature for specified mood or current mood"""
+    def get_temperature(self, mood: str = None, chat_id: Optional[int] = None) -> float:
+        """Get temperature for specified mood or the chat's current mood"""
         if mood is None:
-            mood = self.current_mood
+            mood = self.get_current_mood(chat_id)
         return MOOD_CONFIG[mood]['temperature']
     
-    def reset_mood(self):
-        """Reset mood to neutral"""
-        self.current_mood = 'neutral'
-        self.current_avatar = None
-        self.message_history = []
-        logging.info("[MOOD_MANAGER] Mood reset to neutral")
+    def reset_mood(self, chat_id: int):
+        """Reset the chat's mood to neutral"""
+        self._states.pop(chat_id, None)
+        if self._mood_store is not None:
+            self._mood_store.pop(chat_id, None)
+        logging.info(f"[MOOD_MANAGER] Mood of chat {chat_id} reset to neutral")
     
+    def __len__(self) -> int:
+        return len(self._states)
+
+
+def tone_header_instruction() -> str:
+    """System prompt addition for the structured tone mode"""
+    return (
+        "\n\nStart your reply with a service line [[tone:<mood>]] where <mood> is exactly one of: "
+        f"{', '.join(MOOD_CONFIG)} - the tone of the conversation you are answering. "
+        "Then write the answer itself on the next line. The service line is removed before sending."
+    )
+
+
+def format_tone_header(mood: str) -> str:
+    return f"[[tone:{mood}]]\n"
+
+
+def parse_tone_header(text: str) -> Tuple[Optional[str], str]:
+    """Split a completion into the reported tone (None if missing or unknown) and the answer text"""
+    match = TONE_HEADER_RE.match(text)
+    if not match:
+        return None, text
+    mood = match.group(1).lower()
+    return (mood if mood in MOOD_CONFIG else None), text[match.end():]
+
+
+class ToneHeaderStream:
+    """Strips the tone header from a streamed completion, holding deltas back until the header is resolved"""
+    __slots__ = ('mood', '_buffer', '_resolved')
+
+    def __init__(self):
+        self.mood: Optional[str] = None
+        self._buffer = ''
+        self._resolved = False
+
+    def feed(self, delta: str) -> str:
+        """Return the part of the delta that belongs to the answer"""
+        if self._resolved:
+            return delta
+        self._buffer += delta
+        stripped = self._buffer.lstrip()
+        if ']]' not in stripped and len(stripped) < TONE_HEADER_MAX_LENGTH and '[[tone:'.startswith(stripped[:7].lower()):
+            return ''
+        return self.flush()
+
+    def flush(self) -> str:
+        """Resolve the header with whatever was received and return the held back answer text"""
+        if self._resolved:
+            return ''
+        self._resolved = True
+        self.mood, text = parse_tone_header(self._buffer)
+        self._buffer = ''
+        return text
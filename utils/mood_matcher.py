@@ -0,0 +1,92 @@
+import re
+from collections import deque
+from typing import Dict, FrozenSet, List, Tuple
+
+# Вага збігу ключового слова та регулярного шаблону (як у попередньому посимвольному аналізі)
+KEYWORD_WEIGHT = 1
+PATTERN_WEIGHT = 2
+
+
+class MoodMatcher:
+    """
+    Однопрохідний матчер настрою. Ключові слова з MOOD_CONFIG компілюються один раз в автомат Ахо-Корасік
+    (детермінований: переходи за невдачею розгорнуті заздалегідь), тож текст сканується за один прохід
+    по символах незалежно від кількості ключових слів. Регулярні шаблони компілюються один раз
+    і перевіряються по разу на повідомлення.
+
+    Як і раніше, кожне ключове слово чи шаблон зараховується не більше одного разу.
+    """
+
+    def __init__(self, mood_config: Dict[str, Dict]):
+        self.moods = list(mood_config)
+        # name -> (mood, weight)
+        self._terms: Dict[str, Tuple[str, int]] = {}
+        self._patterns: List[Tuple[str, re.Pattern]] = []
+
+        keywords: List[Tuple[str, str]] = []
+        for mood, config in mood_config.items():
+            for keyword in dict.fromkeys(k.lower() for k in config['keywords']):
+                name = f"k{len(self._terms)}"
+                self._terms[name] = (mood, KEYWORD_WEIGHT)
+                keywords.append((name, keyword))
+            for pattern in config['patterns']:
+                name = f"p{len(self._terms)}"
+                self._terms[name] = (mood, PATTERN_WEIGHT)
+                self._patterns.append((name, re.compile(pattern, re.IGNORECASE)))
+
+        self._transitions, self._outputs = self._build_automaton(keywords)
+
+    @staticmethod
+    def _build_automaton(keywords: List[Tuple[str, str]]) -> Tuple[List[Dict[str, int]], List[FrozenSet[str]]]:
+        """Будує бор ключових слів, посилання невдачі та повну таблицю переходів"""
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[FrozenSet[str]] = [frozenset()]
+        for name, keyword in keywords:
+            state = 0
+            for char in keyword:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    outputs.append(frozenset())
+                state = next_state
+            outputs[state] = outputs[state] | {name}
+
+        # Обхід у ширину: посилання невдачі та розгорнуті переходи для кожного стану
+        fail = [0] * len(goto)
+        transitions: List[Dict[str, int]] = [dict(goto[0])] + [{} for _ in goto[1:]]
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            transitions[state] = {**transitions[fail[state]], **goto[state]}
+            for char, next_state in goto[state].items():
+                fail[next_state] = transitions[fail[state]].get(char, 0)
+                outputs[next_state] = outputs[next_state] | outputs[fail[next_state]]
+                queue.append(next_state)
+        return transitions, outputs
+
+    def scores(self, text: str) -> Dict[str, int]:
+        """Бали настроїв для тексту за один прохід"""
+        scores = dict.fromkeys(self.moods, 0)
+        if not text:
+            return scores
+
+        text_lower = text.lower()
+        transitions = self._transitions
+        outputs = self._outputs
+        found = set()
+        state = 0
+        for char in text_lower:
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                found |= outputs[state]
+
+        for name, pattern in self._patterns:
+            if pattern.search(text_lower):
+                found.add(name)
+
+        for name in found:
+            mood, weight = self._terms[name]
+            scores[mood] += weight
+        return scores
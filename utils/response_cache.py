@@ -0,0 +1,45 @@
+import re
+import hashlib
+from typing import Iterable, Sequence
+
+from config import RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL
+from utils.chat_history import HistoryRecord
+from utils.ttl_cache import TTLCache
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n.,!?;:…"
+
+
+def normalize_question(question: str) -> str:
+    """Нормалізує питання: регістр, пробіли та розділові знаки по краях не впливають на ключ"""
+    return _WHITESPACE_RE.sub(" ", question.lower()).strip(_EDGE_PUNCTUATION)
+
+
+def history_fingerprint(records: Iterable[HistoryRecord], mention_filter) -> str:
+    """
+    Хеш релевантного вікна історії: лише повідомлення людей, без звернень до бота та його відповідей,
+    щоб однакові питання від різних людей мали однаковий контекст
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for record in records:
+        if record.is_bot or mention_filter.matches(record.text):
+            continue
+        digest.update(record.line.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def response_cache_key(model: str, question: str, temperature: float,
+                       history_hash: str, image_keys: Sequence[str] = ()) -> str:
+    """Ключ кешу: модель, нормалізоване питання, кошик температури, хеш історії та зображень"""
+    temperature_bucket = round(temperature, 1)
+    raw = '\x1f'.join([model, normalize_question(question), f"{temperature_bucket:.1f}", history_hash, *image_keys])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+# Глобальний кеш відповідей LLM: ключ -> текст відповіді
+response_cache = TTLCache(
+    ttl=RESPONSE_CACHE_TTL,
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=RESPONSE_CACHE_MAX_BYTES,
+    sizeof=lambda text: len(text.encode('utf-8')),
+)
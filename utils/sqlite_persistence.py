@@ -0,0 +1,222 @@
+import os
+import json
+import zlib
+import pickle
+import sqlite3
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import BASE_DIR, DATABASE, PERSISTENCE_FLUSH_INTERVAL
+
+# user_data, chat_data - по рядку на id; bot_data - один рядок з id = 0
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+
+def _encode(value: Any) -> bytes:
+    """Компактне бінарне кодування: pickle + zlib"""
+    return zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 6)
+
+
+def _decode(blob: bytes) -> Any:
+    return pickle.loads(zlib.decompress(blob))
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Persistence для python-telegram-bot на SQLite (WAL).
+
+    - Запис: Application раз на update_interval передає змінені chat_data/user_data/bot_data та стани розмов;
+      вони лише складаються в чергу, а один фоновий запис кодує їх і пише однією транзакцією в окремому потоці.
+      Жодних синхронних звернень до диска на кожне повідомлення в event loop.
+    - Читання: chat_data та user_data не завантажуються при старті, а підтягуються ліниво
+      при першому оновленні від чату/користувача (refresh_chat_data / refresh_user_data).
+      bot_data та стани ConversationHandler невеликі і завантажуються при старті.
+    """
+
+    def __init__(self, filepath: str = DATABASE, update_interval: float = PERSISTENCE_FLUSH_INTERVAL,
+                 store_data: Optional[PersistenceInput] = None):
+        # Довільні callback_data бот не використовує
+        super().__init__(
+            store_data=store_data or PersistenceInput(callback_data=False),
+            update_interval=update_interval,
+        )
+        self.filepath = filepath if os.path.isabs(filepath) else os.path.join(BASE_DIR, filepath)
+        self._connection: Optional[sqlite3.Connection] = None
+        self._db_lock: Optional[asyncio.Lock] = None
+        # (таблиця, id) -> дані або None для видалення; (name, key) -> стан розмови або None
+        self._staged: Dict[Tuple[str, int], Any] = {}
+        self._staged_conversations: Dict[Tuple[str, str], Any] = {}
+        self._write_task: Optional[asyncio.Task] = None
+        # (таблиця, id), вже доповнені збереженими даними, та ті, що доповнюються зараз
+        self._hydrated: Set[Tuple[str, int]] = set()
+        self._hydrating: Dict[Tuple[str, int], asyncio.Future] = {}
+
+    # --- Робота з базою (виконується в окремому потоці) ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+            connection = sqlite3.connect(self.filepath, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _load_row(self, table: str, row_id: int) -> Any:
+        row = self._connect().execute(f"SELECT data FROM {table} WHERE id = ?", (row_id,)).fetchone()
+        return _decode(row[0]) if row else None
+
+    def _load_conversations(self, name: str) -> Dict[Tuple, Any]:
+        rows = self._connect().execute("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): _decode(state) for key, state in rows}
+
+    def _write_batch(self, staged: Dict[Tuple[str, int], Any], conversations: Dict[Tuple[str, str], Any]) -> None:
+        connection = self._connect()
+        with connection:
+            for (table, row_id), value in staged.items():
+                if value is None:
+                    connection.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,))
+                else:
+                    connection.execute(
+                        f"INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)", (row_id, _encode(value))
+                    )
+            for (name, key), state in conversations.items():
+                if state is None:
+                    connection.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, key))
+                else:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                        (name, key, _encode(state))
+                    )
+
+    async def _run(self, func, *args) -> Any:
+        """Виконує операцію з базою в потоці; операції серіалізуються"""
+        if self._db_lock is None:
+            self._db_lock = asyncio.Lock()
+        async with self._db_lock:
+            return await asyncio.to_thread(func, *args)
+
+    # --- Пакетний запис ---
+
+    def _stage(self, table: str, row_id: int, value: Any) -> None:
+        self._staged[(table, row_id)] = value
+        self._schedule_write()
+
+    def _schedule_write(self) -> None:
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_staged())
+
+    async def _write_staged(self) -> None:
+        # Application оновлює всі змінені чати одним gather - даємо їм усім потрапити в цей пакет
+        await asyncio.sleep(0)
+        while self._staged or self._staged_conversations:
+            staged, self._staged = self._staged, {}
+            conversations, self._staged_conversations = self._staged_conversations, {}
+            try:
+                await self._run(self._write_batch, staged, conversations)
+                logging.info(f"[PERSISTENCE] Записано {len(staged)} записів даних, {len(conversations)} станів розмов")
+            except Exception as e:
+                logging.error(f"[PERSISTENCE] Помилка запису в {self.filepath}: {e}")
+                # Не втрачаємо дані: повертаємо їх у чергу під новіші зміни
+                self._staged = {**staged, **self._staged}
+                self._staged_conversations = {**conversations, **self._staged_conversations}
+                return
+
+    # --- Завантаження ---
+
+    async def get_user_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return await self._run(self._load_row, 'bot_data', 0) or {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple, Any]:
+        return await self._run(self._load_conversations, name)
+
+    async def _hydrate(self, table: str, row_id: int, data: Dict) -> None:
+        """Одноразово доповнює дані чату/користувача збереженими (паралельні виклики чекають на перший)"""
+        key = (table, row_id)
+        if key in self._hydrated:
+            return
+        future = self._hydrating.get(key)
+        if future is not None:
+            # shield: скасування одного з тих, хто чекає, не скасовує спільний future
+            await asyncio.shield(future)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._hydrating[key] = future
+        try:
+            stored = await self._run(self._load_row, table, row_id)
+            if stored:
+                for name, value in stored.items():
+                    data.setdefault(name, value)
+                logging.info(f"[PERSISTENCE] Відновлено {table} для {row_id}")
+        except Exception as e:
+            logging.error(f"[PERSISTENCE] Не вдалося відновити {table} для {row_id}: {e}")
+        finally:
+            self._hydrated.add(key)
+            del self._hydrating[key]
+            future.set_result(None)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        await self._hydrate('chat_data', chat_id, chat_data)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        await self._hydrate('user_data', user_id, user_data)
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+    # --- Оновлення (лише постановка в чергу) ---
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        self._stage('user_data', user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        self._stage('chat_data', chat_id, data)
+
+    async def update_bot_data(self, data: Dict) -> None:
+        self._stage('bot_data', 0, data)
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        self._staged_conversations[(name, json.dumps(list(key)))] = new_state
+        self._schedule_write()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._stage('chat_data', chat_id, None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage('user_data', user_id, None)
+
+    async def flush(self) -> None:
+        """Викликається при зупинці: дописує чергу і закриває з'єднання"""
+        if self._write_task is not None:
+            await self._write_task
+        await self._write_staged()
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
@@ -0,0 +1,142 @@
+import time
+import asyncio
+import logging
+from contextlib import suppress
+from typing import Awaitable, Callable, Optional
+
+from telegram import Bot, InputMediaPhoto, Message
+from telegram.error import BadRequest, RetryAfter
+
+from config import STREAM_EDIT_INTERVAL
+
+# Ліміти довжини тексту повідомлення та підпису до фото в Telegram
+TELEGRAM_TEXT_LIMIT = 4096
+TELEGRAM_CAPTION_LIMIT = 1024
+
+
+class StreamingReply:
+    """
+    Потокова відповідь у чат: одразу надсилає плейсхолдер (текстом або фото з підписом), потім редагує його
+    накопиченим текстом не частіше ніж раз на edit_interval секунд (Telegram обмежує частоту редагувань),
+    а в кінці фіналізує повідомлення повним текстом зі статус-префіксом.
+    Проміжні редагування виконуються у фоновій задачі, тож push не чекає на Telegram і не затримує
+    читання потоку від моделі; редагування завжди показує найсвіжіший накопичений текст.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, reply_to_message_id: Optional[int] = None,
+                 edit_interval: float = STREAM_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.reply_to_message_id = reply_to_message_id
+        self.edit_interval = edit_interval
+        self.message: Optional[Message] = None
+        self._parts = []
+        self._shown_text = ""
+        self._next_edit_at = 0.0
+        self._edit_task: Optional[asyncio.Task] = None
+
+    @property
+    def text(self) -> str:
+        """Накопичений текст відповіді"""
+        return ''.join(self._parts)
+
+    @property
+    def _limit(self) -> int:
+        return TELEGRAM_CAPTION_LIMIT if self.message is not None and self.message.photo else TELEGRAM_TEXT_LIMIT
+
+    async def start(self, placeholder: str = "🤖 ...",
+                    send: Optional[Callable[[str], Awaitable[Message]]] = None) -> None:
+        """
+        Надсилає плейсхолдер, який далі редагуватиметься.
+        send - власний спосіб надсилання (наприклад, фото настрою з підписом); за замовчуванням текст
+        """
+        if send is not None:
+            self.message = await send(placeholder)
+        else:
+            self.message = await self.bot.send_message(
+                chat_id=self.chat_id,
+                text=placeholder,
+                reply_to_message_id=self.reply_to_message_id
+            )
+        self._shown_text = placeholder
+
+    def push(self, delta: str) -> None:
+        """Додає фрагмент і, якщо оновлення ще не заплановано, планує його у фоні"""
+        self._parts.append(delta)
+        if self.message is not None and (self._edit_task is None or self._edit_task.done()):
+            self._edit_task = asyncio.create_task(self._edit_latest())
+
+    async def _edit_latest(self) -> None:
+        delay = self._next_edit_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            await self._edit(self.text + " ▌")
+        except Exception as e:
+            logging.warning(f"[STREAMING] Не вдалося оновити повідомлення: {e}")
+
+    async def finish(self, final_text: str, photo=None) -> Optional[Message]:
+        """
+        Фіналізує відповідь; якщо плейсхолдер не вдалося надіслати, надсилає нове повідомлення.
+        photo - нове фото для повідомлення-фото (наприклад, якщо настрій змінився під час генерації).
+        Текст, що не вміщується в підпис до фото, надсилається окремим повідомленням у відповідь.
+        Повертає повідомлення після зміни фото (щоб викликач міг запам'ятати file_id), інакше None
+        """
+        if self._edit_task is not None:
+            self._edit_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._edit_task
+        if self.message is None:
+            await self.bot.send_message(
+                chat_id=self.chat_id,
+                text=final_text[:TELEGRAM_TEXT_LIMIT],
+                reply_to_message_id=self.reply_to_message_id
+            )
+            return None
+
+        head, tail = final_text[:self._limit], final_text[self._limit:]
+        # Фінальне редагування обов'язкове, тому чекаємо на вікно rate limit
+        delay = self._next_edit_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        edited = None
+        if photo is not None and self.message.photo:
+            try:
+                edited = await self.message.edit_media(InputMediaPhoto(photo, caption=head))
+                self._shown_text = head
+            except BadRequest as e:
+                logging.warning(f"[STREAMING] Не вдалося замінити фото: {e}")
+        if edited is None:
+            await self._edit(head, final=True)
+        if tail.strip():
+            await self.bot.send_message(
+                chat_id=self.chat_id,
+                text=tail[:TELEGRAM_TEXT_LIMIT],
+                reply_to_message_id=self.message.message_id
+            )
+        return edited if isinstance(edited, Message) else None
+
+    async def _apply(self, text: str) -> None:
+        if self.message.photo:
+            await self.message.edit_caption(caption=text)
+        else:
+            await self.message.edit_text(text)
+        self._shown_text = text
+
+    async def _edit(self, text: str, final: bool = False) -> None:
+        text = text[:self._limit]
+        if not text.strip() or text == self._shown_text:
+            return
+        self._next_edit_at = time.monotonic() + self.edit_interval
+        try:
+            await self._apply(text)
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            logging.warning(f"[STREAMING] Flood control, пауза {retry_after} с")
+            self._next_edit_at = time.monotonic() + retry_after
+            if final:
+                await asyncio.sleep(retry_after)
+                await self._apply(text)
+        except BadRequest as e:
+            # "Message is not modified" та подібні помилки проміжних редагувань не критичні
+            logging.warning(f"[STREAMING] Не вдалося оновити повідомлення: {e}")
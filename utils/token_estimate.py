@@ -0,0 +1,51 @@
+import math
+from typing import Optional
+
+# Середня кількість символів на токен: латиниця токенізується щільніше, кирилиця та емодзі - гірше
+ASCII_CHARS_PER_TOKEN = 4.0
+OTHER_CHARS_PER_TOKEN = 2.5
+# Службові токени на кожне повідомлення в messages
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Вартість зображень у vision-моделях OpenAI: detail=low - фіксовано, high - базова частина + плитки 512x512
+IMAGE_LOW_DETAIL_TOKENS = 85
+IMAGE_TILE_TOKENS = 170
+IMAGE_TILE_SIZE = 512
+# Оцінка для зображення з невідомими розмірами (1024x1024, detail=high)
+IMAGE_DEFAULT_TOKENS = 765
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Швидка оцінка кількості токенів тексту без токенізатора"""
+    if not text:
+        return 0
+    ascii_chars = sum(1 for char in text if char < '\x80')
+    other_chars = len(text) - ascii_chars
+    return math.ceil(ascii_chars / ASCII_CHARS_PER_TOKEN + other_chars / OTHER_CHARS_PER_TOKEN)
+
+
+def estimate_image_tokens(width: Optional[int], height: Optional[int], detail: str = 'high') -> int:
+    """
+    Оцінка токенів зображення за правилами OpenAI: вписати в 2048x2048, зменшити коротшу сторону до 768,
+    порахувати плитки 512x512
+    """
+    if detail == 'low':
+        return IMAGE_LOW_DETAIL_TOKENS
+    if not width or not height:
+        return IMAGE_DEFAULT_TOKENS
+
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE)
+    return IMAGE_LOW_DETAIL_TOKENS + IMAGE_TILE_TOKENS * tiles
+
+
+def truncate_to_tokens(text: str, max_tokens: int, suffix: str = "…") -> str:
+    """Обрізає текст приблизно до max_tokens токенів"""
+    if estimate_text_tokens(text) <= max_tokens:
+        return text
+    # Кількість символів з консервативною (кириличною) оцінкою
+    limit = max(0, int(max_tokens * OTHER_CHARS_PER_TOKEN) - len(suffix))
+    return text[:limit].rstrip() + suffix
@@ -0,0 +1,302 @@
+import os
+import json
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import (
+    SEARCH_INDEX_BATCH_SIZE, SEARCH_INDEX_FLUSH_INTERVAL, VECTOR_INDEX_DIR, VECTOR_INDEX_MAX_OPEN_CHATS
+)
+from utils.embeddings import Embedder, create_embedder
+from utils.message_index import MAX_PENDING_ROWS, SearchResult
+
+# Початкова місткість матриці чату (рядків); далі місткість подвоюється
+INITIAL_CAPACITY = 256
+# Скільки символів повідомлення зберігається в метаданих (для промпта досить початку)
+MAX_STORED_TEXT = 1000
+
+
+class ChatVectors:
+    """
+    Вектори повідомлень одного чату: матриця float32 (capacity x dim) у файлі {chat_id}.f32, відображеному
+    в пам'ять (np.memmap), і метадані рядків у {chat_id}.jsonl (перший рядок - заголовок з назвою ембедера).
+    Додавання пише лише нові рядки матриці та дописує метадані; файл матриці росте подвоєнням місткості,
+    тож перевідображення трапляється рідко. У пам'яті тримаються лише message_id та зсуви рядків у файлі
+    метаданих, самі метадані читаються з диска лише для знайдених рядків.
+    Файли створюються лише при першому додаванні: пошук у чаті без векторів нічого не пише на диск.
+    Усі методи виконуються в окремому потоці під замком індексу.
+    """
+
+    def __init__(self, directory: str, chat_id: int, embedder: Embedder):
+        self.matrix_path = os.path.join(directory, f'{chat_id}.f32')
+        self.meta_path = os.path.join(directory, f'{chat_id}.jsonl')
+        self.embedder_name = embedder.name
+        self.dim = embedder.dim
+        self.count = 0
+        self.capacity = 0
+        self.matrix: Optional[np.memmap] = None
+        self.message_ids = np.empty(0, dtype=np.int64)
+        # Зсув рядка метаданих (message_id, username, text, timestamp) у файлі для кожного рядка матриці
+        self.offsets = np.empty(0, dtype=np.int64)
+        self._load()
+
+    def _load(self) -> None:
+        message_ids, offsets = [], []
+        broken_at = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'rb') as f:
+                header = json.loads(f.readline() or b'{}')
+                if header.get('embedder') == self.embedder_name and header.get('dim') == self.dim:
+                    while True:
+                        offset = f.tell()
+                        line = f.readline()
+                        if not line:
+                            break
+                        try:
+                            message_ids.append(json.loads(line)[0])
+                        except ValueError:
+                            # Обірваний запис у кінці файлу відкидається разом з усім, що за ним
+                            logging.warning(f"[VECTOR_INDEX] {self.meta_path}: пошкоджений рядок метаданих, обрізаємо")
+                            broken_at = offset
+                            break
+                        offsets.append(offset)
+                else:
+                    logging.warning(
+                        f"[VECTOR_INDEX] {self.meta_path}: індекс побудовано ембедером {header.get('embedder')}, "
+                        f"поточний {self.embedder_name} - індекс чату починається заново"
+                    )
+                    header = None
+            if broken_at is not None:
+                os.truncate(self.meta_path, broken_at)
+            if header is None:
+                os.remove(self.meta_path)
+                if os.path.exists(self.matrix_path):
+                    os.remove(self.matrix_path)
+        if not os.path.exists(self.meta_path):
+            # Файли чату створюються лише при першому додаванні (append)
+            return
+
+        # Кількість рядків визначають метадані: вектор пишеться раніше за свої метадані, тож вектор без
+        # метаданих (обрив запису) просто перезапишеться наступним додаванням. Розмір файлу матриці - це
+        # місткість, а не кількість записаних рядків
+        stored_capacity = os.path.getsize(self.matrix_path) // (4 * self.dim) if os.path.exists(self.matrix_path) else 0
+        self._remap(max(stored_capacity, len(offsets), INITIAL_CAPACITY))
+        self.count = len(offsets)
+        self.message_ids[:self.count] = [message_id if message_id is not None else -1 for message_id in message_ids]
+        self.offsets[:self.count] = offsets
+
+    def _remap(self, capacity: int) -> None:
+        """Розширює файл матриці до capacity рядків і відображає його заново"""
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+        with open(self.matrix_path, 'ab') as f:
+            if f.tell() < capacity * self.dim * 4:
+                f.truncate(capacity * self.dim * 4)
+        self.matrix = np.memmap(self.matrix_path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        message_ids = np.full(capacity, -1, dtype=np.int64)
+        message_ids[:self.count] = self.message_ids[:self.count]
+        self.message_ids = message_ids
+        offsets = np.zeros(capacity, dtype=np.int64)
+        offsets[:self.count] = self.offsets[:self.count]
+        self.offsets = offsets
+        self.capacity = capacity
+
+    def append(self, vectors: np.ndarray, rows: Sequence[Tuple]) -> None:
+        needed = self.count + len(rows)
+        if self.matrix is None:
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'embedder': self.embedder_name, 'dim': self.dim}) + '\n')
+            self._remap(max(needed, INITIAL_CAPACITY))
+        elif needed > self.capacity:
+            self._remap(max(needed, self.capacity * 2))
+        self.matrix[self.count:needed] = vectors
+        self.matrix.flush()
+        with open(self.meta_path, 'ab') as f:
+            for position, row in enumerate(rows, start=self.count):
+                self.offsets[position] = f.tell()
+                f.write((json.dumps(list(row), ensure_ascii=False) + '\n').encode('utf-8'))
+        self.message_ids[self.count:needed] = [row[0] if row[0] is not None else -1 for row in rows]
+        self.count = needed
+
+    def rows(self, positions: Sequence[int]) -> List[Tuple]:
+        """Метадані (message_id, username, text, timestamp) рядків матриці, прочитані з диска"""
+        rows = []
+        with open(self.meta_path, 'rb') as f:
+            for position in positions:
+                f.seek(int(self.offsets[position]))
+                rows.append(tuple(json.loads(f.readline())))
+        return rows
+
+    def search(self, queries: np.ndarray, limit: int, min_score: float,
+               exclude_message_ids: Sequence[int]) -> List[Tuple[int, float]]:
+        """
+        (рядок, схожість) найкращих збігів: один матричний добуток усіх векторів чату на всі запити,
+        схожість рядка - максимум по запитах
+        """
+        if self.count == 0:
+            return []
+        scores = self.matrix[:self.count] @ queries.T
+        scores = scores.max(axis=1) if scores.ndim == 2 else scores
+        if exclude_message_ids:
+            scores[np.isin(self.message_ids[:self.count], np.fromiter(exclude_message_ids, dtype=np.int64))] = -1.0
+        limit = min(limit, self.count)
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top if scores[row] >= min_score]
+
+    def close(self) -> None:
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+
+
+class VectorIndex:
+    """
+    Семантичний індекс повідомлень по чатах. Повідомлення накопичуються в черзі і пакетами
+    перетворюються на вектори (ембедер підключається: локальний хешувальний або OpenAI),
+    після чого дописуються в матрицю чату. Відкриті матриці тримаються в LRU на max_open чатів.
+    """
+
+    def __init__(self, directory: str = VECTOR_INDEX_DIR, embedder: Optional[Embedder] = None,
+                 batch_size: int = SEARCH_INDEX_BATCH_SIZE, flush_interval: float = SEARCH_INDEX_FLUSH_INTERVAL,
+                 max_open: int = VECTOR_INDEX_MAX_OPEN_CHATS):
+        self.directory = directory
+        self.embedder = embedder or create_embedder()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_open = max_open
+        self._chats: 'OrderedDict[int, ChatVectors]' = OrderedDict()
+        self._lock: Optional[asyncio.Lock] = None
+        self._pending: List[Tuple[int, Tuple]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _chat(self, chat_id: int) -> ChatVectors:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            os.makedirs(self.directory, exist_ok=True)
+            chat = self._chats[chat_id] = ChatVectors(self.directory, chat_id, self.embedder)
+            while len(self._chats) > self.max_open:
+                _, evicted = self._chats.popitem(last=False)
+                evicted.close()
+        else:
+            self._chats.move_to_end(chat_id)
+        return chat
+
+    async def _run(self, func, *args):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            return await asyncio.to_thread(func, *args)
+
+    # --- Запис ---
+
+    def add(self, chat_id: int, message_id: Optional[int], username: str, text: str,
+            timestamp: Optional[float]) -> None:
+        """Ставить повідомлення в чергу на векторизацію"""
+        if not text or not text.strip():
+            return
+        self._pending.append((chat_id, (message_id, username, text[:MAX_STORED_TEXT], timestamp)))
+        if len(self._pending) >= self.batch_size:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush())
+
+    def _append(self, batches: Dict[int, Tuple[np.ndarray, List[Tuple]]]) -> List[int]:
+        """Дописує пакети в матриці чатів; повертає чати, запис яких не вдався"""
+        failed = []
+        for chat_id, (vectors, rows) in batches.items():
+            try:
+                self._chat(chat_id).append(vectors, rows)
+            except Exception as e:
+                logging.error(f"[VECTOR_INDEX] Не вдалося записати {len(rows)} векторів чату {chat_id}: {e}")
+                failed.append(chat_id)
+        return failed
+
+    async def flush(self) -> None:
+        """Векторизує чергу одним викликом ембедера і дописує рядки в матриці чатів"""
+        while self._pending:
+            pending, self._pending = self._pending, []
+            try:
+                vectors = await self.embedder.embed([row[2] for _, row in pending])
+                batches: Dict[int, Tuple[List[int], List[Tuple]]] = {}
+                for position, (chat_id, row) in enumerate(pending):
+                    positions, rows = batches.setdefault(chat_id, ([], []))
+                    positions.append(position)
+                    rows.append(row)
+                failed = set(await self._run(self._append, {
+                    chat_id: (vectors[positions], rows) for chat_id, (positions, rows) in batches.items()
+                }))
+            except Exception as e:
+                logging.error(f"[VECTOR_INDEX] Не вдалося проіндексувати {len(pending)} повідомлень: {e}")
+                failed = None
+            if failed is None or failed:
+                # Не втрачаємо повідомлення: повертаємо в чергу перед новішими (лише ті, що не записались)
+                self._requeue([item for item in pending if failed is None or item[0] in failed])
+                return
+
+    def _requeue(self, items: List[Tuple[int, Tuple]]) -> None:
+        self._pending = items + self._pending
+        if len(self._pending) > MAX_PENDING_ROWS:
+            dropped = len(self._pending) - MAX_PENDING_ROWS
+            self._pending = self._pending[dropped:]
+            logging.error(f"[VECTOR_INDEX] Черга переповнена, відкинуто {dropped} найстаріших повідомлень")
+
+    async def close(self) -> None:
+        """Викликається при зупинці: дописує чергу і скидає матриці на диск"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is not None:
+            await self._flush_task
+        await self.flush()
+        await self._run(self._close_all)
+
+    def _close_all(self) -> None:
+        while self._chats:
+            _, chat = self._chats.popitem()
+            chat.close()
+
+    # --- Пошук ---
+
+    def _search(self, chat_id: int, queries: np.ndarray, limit: int, min_score: float,
+                exclude_message_ids: Sequence[int]) -> List[SearchResult]:
+        chat = self._chat(chat_id)
+        if chat.count == 0:
+            return []
+        found = chat.search(queries, limit, min_score, exclude_message_ids)
+        results = []
+        for (message_id, username, text, timestamp), (_, score) in zip(chat.rows([row for row, _ in found]), found):
+            results.append(SearchResult(chat_id, message_id, username, text, timestamp, text, score))
+        return results
+
+    async def search(self, chat_id: int, queries: Sequence[str], limit: int = 5, min_score: float = 0.0,
+                     exclude_message_ids: Sequence[int] = ()) -> List[SearchResult]:
+        """
+        Найсхожіші за змістом повідомлення чату (найкращі першими); rank результату - косинусна схожість.
+        Кілька запитів (наприклад, кілька звернень в одній відповіді) оцінюються одним матричним добутком.
+        """
+        queries = [query for query in queries if query.strip()]
+        if not queries:
+            return []
+        try:
+            query_vectors = await self.embedder.embed(queries)
+            return await self._run(self._search, chat_id, query_vectors, limit, min_score, tuple(exclude_message_ids))
+        except Exception as e:
+            logging.error(f"[VECTOR_INDEX] Помилка пошуку в чаті {chat_id}: {e}")
+            return []
+
+
+# Глобальний семантичний індекс
+vector_index = VectorIndex()